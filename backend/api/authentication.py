@@ -0,0 +1,69 @@
+import copy
+
+from django.conf import settings
+from rest_framework.authentication import TokenAuthentication
+
+from .cache import LRUCache, auth_scope, get_generations, shared_cache
+
+token_cache = LRUCache(
+    settings.AUTH_TOKEN_CACHE_SIZE, settings.AUTH_TOKEN_CACHE_TTL
+)
+
+
+def request_user(user):
+    """
+    Копия снимка для запроса: вью может менять request.user. Снимок
+    может отстать от базы (last_login не сбрасывает его, update() обходит
+    сигналы), поэтому save() без update_fields пишет только поля,
+    измененные во время запроса.
+    """
+
+    snapshot = copy.copy(user)
+    fields = [field.attname for field in snapshot._meta.concrete_fields]
+
+    def values():
+        current = {}
+        for name in fields:
+            value = getattr(snapshot, name)
+            # Файл сравнивается по имени: FieldFile меняется на месте.
+            current[name] = getattr(value, 'name', value)
+        return current
+
+    loaded, save = values(), snapshot.save
+
+    def save_changed(*args, **kwargs):
+        if not args and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                name for name, value in values().items()
+                if loaded[name] != value
+            ]
+        save(*args, **kwargs)
+
+    snapshot.save = save_changed
+    return snapshot
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication, который хранит снимок токена и пользователя
+    в процессном кэше вместо запроса Token ⋈ User на каждый запрос.
+    Снимок сверяется с поколением пользователя в общем кэше: выход,
+    смена пароля, деактивация и удаление сдвигают его в любом процессе
+    (см. api.signals). С процессным кэшем поколений класс не работает.
+    """
+
+    def __init__(self):
+        shared_cache()
+        super().__init__()
+
+    def authenticate_credentials(self, key):
+        entry = token_cache.get(key)
+        if entry is not None:
+            user, token, generation = entry
+            if get_generations(auth_scope(user.pk)) == [generation]:
+                return request_user(user), token
+            token_cache.delete(key)
+        user, token = super().authenticate_credentials(key)
+        generation, = get_generations(auth_scope(user.pk))
+        token_cache.set(key, (copy.copy(user), token, generation))
+        return user, token
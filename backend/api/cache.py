@@ -0,0 +1,191 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+
+RECIPES_SCOPE = 'recipes'
+INGREDIENTS_SCOPE = 'ingredients'
+TAGS_SCOPE = 'tags'
+GENERATION_KEY = 'generation:{}'
+RESPONSE_KEY = 'response:{scope}:{generations}:{user}:{params}'
+STATS_KEY = 'response_cache_stats:{}'
+STATS_FIELDS = ('hits', 'misses')
+SHARED_CACHE = 'shared'
+PROCESS_LOCAL_CACHES = (LocMemCache, DummyCache)
+
+
+def user_scope(user_id):
+    """Область поколений, относящаяся к конкретному пользователю."""
+
+    return f'user:{user_id}'
+
+
+def profile_scope(user_id):
+    """Область поколений профиля пользователя как автора рецептов."""
+
+    return f'profile:{user_id}'
+
+
+def auth_scope(user_id):
+    """Область поколений снимков пользователя в кэше аутентификации."""
+
+    return f'auth:{user_id}'
+
+
+def now_generation():
+    return time.time_ns() // 1000
+
+
+def generation_timestamp(generation):
+    """Поколение — время изменения в микросекундах; переводит в секунды."""
+
+    return generation // 1_000_000
+
+
+def shared_cache():
+    """
+    Кэш поколений, общий для всех процессов. Процессный кэш здесь
+    недопустим: каждый воркер выдавал бы свои ETag и не замечал
+    изменений, сделанных в других процессах.
+    """
+
+    backend = caches[SHARED_CACHE]
+    if isinstance(backend, PROCESS_LOCAL_CACHES):
+        raise ImproperlyConfigured(
+            f'Кэш {SHARED_CACHE!r} должен быть общим для процессов'
+        )
+    return backend
+
+
+def get_generations(*scopes):
+    """
+    Возвращает текущие поколения для областей одним запросом к кэшу.
+    Отсутствующее поколение заводится текущим временем, поэтому после
+    очистки кэша значения не повторяют выданные ранее.
+    """
+
+    store = shared_cache()
+    keys = {GENERATION_KEY.format(scope): scope for scope in scopes}
+    stored = store.get_many(keys)
+    missing = [key for key in keys if key not in stored]
+    if missing:
+        generation = now_generation()
+        for key in missing:
+            store.add(key, generation, timeout=None)
+        stored.update(store.get_many(missing))
+    return [stored.get(key, 0) for key in keys]
+
+
+def bump_generation(scope):
+    """
+    Сдвигает поколение области на текущее время (не меньше чем на единицу).
+    Старые ключи перестают совпадать и вытесняются кэшем сами.
+    """
+
+    store = shared_cache()
+    key = GENERATION_KEY.format(scope)
+    current = store.get(key, 0)
+    store.set(key, max(current + 1, now_generation()), timeout=None)
+
+
+def response_cache_key(request, scope):
+    """
+    Ключ кэша ответа: нормализованные параметры запроса,
+    поколения данных и пользовательская область.
+    """
+
+    params = sorted(
+        (name, sorted(values))
+        for name, values in request.query_params.lists()
+    )
+    raw = f'{request.get_host()}{request.path}{params}'
+    user = request.user
+    if user.is_authenticated:
+        generations = get_generations(scope, user_scope(user.pk))
+        user_key = user.pk
+    else:
+        generations = get_generations(scope)
+        user_key = 'anon'
+    return RESPONSE_KEY.format(
+        scope=scope,
+        generations='.'.join(map(str, generations)),
+        user=user_key,
+        params=hashlib.sha1(raw.encode()).hexdigest(),
+    )
+
+
+def get_cached_response(key):
+    data = cache.get(key)
+    record_stat('hits' if data is not None else 'misses')
+    return data
+
+
+def set_cached_response(key, data):
+    cache.set(key, data, timeout=settings.RESPONSE_CACHE_TIMEOUT)
+
+
+def record_stat(name):
+    """Счетчики общие для воркеров: эндпоинт статистики видит все."""
+
+    store = shared_cache()
+    key = STATS_KEY.format(name)
+    if not store.add(key, 1, timeout=None):
+        try:
+            store.incr(key)
+        except ValueError:
+            store.add(key, 1, timeout=None)
+
+
+def get_stats():
+    stored = shared_cache().get_many(
+        [STATS_KEY.format(name) for name in STATS_FIELDS]
+    )
+    return {
+        name: stored.get(STATS_KEY.format(name), 0) for name in STATS_FIELDS
+    }
+
+
+class LRUCache:
+    """
+    Ограниченный по размеру процессный кэш с вытеснением давних ключей.
+    С ttl записи к тому же устаревают через ttl секунд.
+    """
+
+    def __init__(self, max_size, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = value, expires
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+short_link_cache = LRUCache(settings.SHORT_LINK_CACHE_SIZE)
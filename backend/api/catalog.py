@@ -0,0 +1,80 @@
+import bisect
+import threading
+import time
+from array import array
+
+from django.conf import settings
+from foodgram_backend.routers import primary_reads
+from recipes.models import Ingredient, Tag
+
+from .cache import INGREDIENTS_SCOPE, TAGS_SCOPE, get_generations
+
+
+class IdCatalog:
+    """
+    Процессный справочник существующих первичных ключей модели:
+    отсортированный array('q') вместо объектов. Перестраивается лениво
+    при смене поколения области или по истечении ID_CATALOG_TTL.
+    """
+
+    def __init__(self, model, scope):
+        self.model = model
+        self.scope = scope
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    def invalidate(self):
+        self._snapshot = None
+
+    @primary_reads()
+    def missing(self, ids):
+        """
+        Множество ids, которых нет в справочнике. Ненайденное
+        перепроверяется одним запросом: объект мог появиться
+        в другом процессе раньше, чем сюда дошло новое поколение.
+        """
+
+        known = self._get_ids()
+        missing = set()
+        for pk in set(ids):
+            position = bisect.bisect_left(known, pk)
+            if position == len(known) or known[position] != pk:
+                missing.add(pk)
+        if missing:
+            found = set(self.model.objects.filter(
+                pk__in=missing
+            ).values_list('pk', flat=True))
+            if found:
+                self.invalidate()
+                missing -= found
+        return missing
+
+    def _get_ids(self):
+        generation, = get_generations(self.scope)
+        snapshot = self._snapshot
+        if not self._is_fresh(snapshot, generation):
+            with self._lock:
+                snapshot = self._snapshot
+                if not self._is_fresh(snapshot, generation):
+                    snapshot = self._build(generation)
+                    self._snapshot = snapshot
+        return snapshot[2]
+
+    @staticmethod
+    def _is_fresh(snapshot, generation):
+        return (
+            snapshot is not None
+            and snapshot[0] == generation
+            and time.monotonic() - snapshot[1] < settings.ID_CATALOG_TTL
+        )
+
+    @primary_reads()
+    def _build(self, generation):
+        ids = array('q', self.model.objects.order_by('pk').values_list(
+            'pk', flat=True
+        ).iterator())
+        return generation, time.monotonic(), ids
+
+
+ingredient_catalog = IdCatalog(Ingredient, INGREDIENTS_SCOPE)
+tag_catalog = IdCatalog(Tag, TAGS_SCOPE)
@@ -0,0 +1,46 @@
+import hashlib
+
+from django.utils.cache import (get_conditional_response, patch_vary_headers,
+                                quote_etag)
+from django.utils.http import http_date
+from foodgram_backend.routers import primary_reads
+
+from .cache import generation_timestamp, get_generations
+
+
+def catalog_validators(scope):
+    """ETag и Last-Modified справочника по версии его таблицы."""
+
+    generation, = get_generations(scope)
+    return (
+        quote_etag(f'{scope}-{generation}'),
+        generation_timestamp(generation)
+    )
+
+
+def make_etag(*parts):
+    return quote_etag(
+        hashlib.md5(':'.join(map(str, parts)).encode()).hexdigest()
+    )
+
+
+def conditional_get(request, validators, view, *args, **kwargs):
+    """
+    Отвечает 304 Not Modified по совпавшим валидаторам, не вызывая вью.
+    Иначе вызывает вью и проставляет ETag и Last-Modified в ответ.
+    Тело читается с primary: ETag построен по его версиям.
+    """
+
+    etag, last_modified = validators
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified
+    )
+    if response is None:
+        with primary_reads():
+            response = view(request, *args, **kwargs)
+    if response.status_code in (200, 304):
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        patch_vary_headers(response, ('Authorization',))
+    return response
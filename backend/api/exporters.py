@@ -0,0 +1,75 @@
+import csv
+import json
+
+from django.conf import settings
+from recipes.models import ShoppingListItem
+
+from .pdf import StreamingPDF
+
+SHOPPING_LIST_TITLE = 'Ваш список покупок:'
+CSV_HEADER = ('Ингредиент', 'Количество', 'Единица измерения')
+
+
+class Echo:
+    """Псевдобуфер для csv.writer: возвращает строку вместо записи."""
+
+    def write(self, value):
+        return value
+
+
+def shopping_list_rows(user):
+    """
+    Позиции материализованного списка покупок пользователя в порядке
+    названия и единицы измерения. Строки читаются серверным курсором.
+    """
+
+    return ShoppingListItem.objects.filter(user=user).values_list(
+        'ingredient__name', 'ingredient__measurement_unit', 'amount'
+    ).order_by(
+        'ingredient__name', 'ingredient__measurement_unit'
+    ).iterator(chunk_size=settings.SHOPPING_LIST_CHUNK_SIZE)
+
+
+def format_line(name, measurement_unit, amount):
+    return f'{name}: {amount} {measurement_unit}'
+
+
+def export_txt(rows):
+    yield f'{SHOPPING_LIST_TITLE}\n'
+    for row in rows:
+        yield '\n' + format_line(*row)
+
+
+def export_csv(rows):
+    writer = csv.writer(Echo())
+    # BOM нужен, чтобы Excel распознал UTF-8.
+    yield '\ufeff' + writer.writerow(CSV_HEADER)
+    for name, measurement_unit, amount in rows:
+        yield writer.writerow((name, amount, measurement_unit))
+
+
+def export_json(rows):
+    separator = '['
+    for name, measurement_unit, amount in rows:
+        yield separator + json.dumps({
+            'name': name,
+            'amount': amount,
+            'measurement_unit': measurement_unit,
+        }, ensure_ascii=False)
+        separator = ','
+    yield '[]' if separator == '[' else ']'
+
+
+def export_pdf(rows):
+    document = StreamingPDF(settings.SHOPPING_LIST_PDF_FONT)
+    return document.render(
+        SHOPPING_LIST_TITLE, (format_line(*row) for row in rows)
+    )
+
+
+EXPORT_FORMATS = {
+    'txt': ('text/plain; charset=utf-8', export_txt),
+    'csv': ('text/csv; charset=utf-8', export_csv),
+    'json': ('application/json', export_json),
+    'pdf': ('application/pdf', export_pdf),
+}
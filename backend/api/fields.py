@@ -0,0 +1,68 @@
+from django.core.files.uploadedfile import UploadedFile
+from drf_extra_fields.fields import Base64ImageField
+from PIL import Image
+from rest_framework import serializers
+
+from .images import IMAGE_MAX_PIXELS, image_srcset
+
+
+class ImageUploadField(Base64ImageField):
+    """
+    Картинка строкой base64 в JSON или файлом из multipart/form-data.
+    Файл уже лежит во временном файле, Pillow читает из него только
+    заголовок: формат и размеры, без декодирования пикселей.
+    """
+
+    ALLOWED_TYPES = ('jpeg', 'jpg', 'png', 'gif', 'webp')
+
+    def to_internal_value(self, data):
+        if not isinstance(data, UploadedFile):
+            image = super().to_internal_value(data)
+            if image is not None:
+                self.read_header(image)
+            return image
+        image_format = self.read_header(data)
+        data.name = f'{self.get_file_name(None)}.{image_format}'
+        return data
+
+    def read_header(self, file):
+        """Проверяет формат и размеры картинки, возвращает расширение."""
+
+        file.seek(0)
+        try:
+            with Image.open(file) as image:
+                image_format = (image.format or '').lower()
+                width, height = image.size
+        except (OSError, SyntaxError, Image.DecompressionBombError):
+            raise serializers.ValidationError(self.INVALID_FILE_MESSAGE)
+        finally:
+            file.seek(0)
+        if image_format not in self.ALLOWED_TYPES:
+            raise serializers.ValidationError(self.INVALID_TYPE_MESSAGE)
+        if width * height > IMAGE_MAX_PIXELS:
+            raise serializers.ValidationError(
+                f'Картинка больше {IMAGE_MAX_PIXELS // 1_000_000} Мпикс.'
+            )
+        return image_format
+
+
+class SrcsetField(serializers.Field):
+    """
+    Карта URL рендишенов изображения по размерам и форматам.
+    Пока рендишены строятся, на их месте отдается оригинал.
+    """
+
+    def __init__(self, renditions, **kwargs):
+        self.renditions = renditions
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        request = self.context.get('request')
+        return image_srcset(
+            value.name,
+            self.renditions,
+            request.build_absolute_uri if request else str
+        )
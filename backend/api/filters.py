@@ -1,8 +1,17 @@
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            TrigramSimilarity)
+from django.db.models import F, Q
 from django_filters.rest_framework import FilterSet, filters
+from recipes.constants import SEARCH_CONFIG
 from recipes.models import Ingredient, Recipe, Tag
 
 
 class IngredientFilter(FilterSet):
+    """
+    Поиск ингредиентов запросом к базе. API ищет по индексу
+    (api.ingredient_index), фильтр остается базой для сравнения
+    в benchmark_ingredient_search.
+    """
 
     name = filters.CharFilter(lookup_expr='istartswith')
 
@@ -20,10 +29,12 @@ class RecipeFilter(FilterSet):
     is_favorited = filters.BooleanFilter(method='is_favorited_filter')
     is_in_shopping_cart = filters.BooleanFilter(
         method='is_in_shopping_cart_filter')
+    search = filters.CharFilter(method='search_filter')
 
     class Meta:
         model = Recipe
-        fields = ('tags', 'author', 'is_favorited', 'is_in_shopping_cart')
+        fields = ('tags', 'author', 'is_favorited', 'is_in_shopping_cart',
+                  'search')
 
     def is_favorited_filter(self, queryset, name, value):
         user = self.request.user
@@ -36,3 +47,21 @@ class RecipeFilter(FilterSet):
         if value and user.is_authenticated:
             return queryset.filter(shopping_cart__user=user)
         return queryset
+
+    def search_filter(self, queryset, name, value):
+        """
+        Полнотекстовый поиск по названию и описанию
+        с допуском опечаток в названии через триграммы.
+        Результаты упорядочены по релевантности.
+        """
+
+        query = SearchQuery(
+            value, config=SEARCH_CONFIG, search_type='websearch'
+        )
+        similarity = TrigramSimilarity('name', value)
+        return queryset.annotate(
+            search_rank=SearchRank(F('search_vector'), query) + similarity
+        ).filter(
+            Q(search_vector=query)
+            | Q(name__trigram_similar=value)
+        ).order_by('-search_rank', '-pub_date', '-id')
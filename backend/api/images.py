@@ -0,0 +1,176 @@
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import connection
+from PIL import Image, ImageOps
+
+from .cache import shared_cache
+
+logger = logging.getLogger(__name__)
+
+RENDITION_SIZES = {
+    'card': (600, 400),
+    'thumbnail': (300, 200),
+    'avatar': (128, 128),
+}
+RECIPE_RENDITIONS = ('card', 'thumbnail')
+AVATAR_RENDITIONS = ('avatar',)
+RENDITION_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+# Больше не принимаем: рендишены декодируют картинку целиком.
+IMAGE_MAX_PIXELS = 40_000_000
+RENDITIONS_DIR = 'renditions'
+READY_KEY = 'renditions_ready:{}'
+# Отсутствие рендишенов кэшируется ненадолго: их может дописать
+# пул другого процесса.
+MISSING_TIMEOUT = 30
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def rendition_name(name, rendition, extension):
+    """recipes/images/a.png -> renditions/recipes/images/a.card.webp"""
+
+    stem, _ = os.path.splitext(name)
+    return f'{RENDITIONS_DIR}/{stem}.{rendition}.{extension}'
+
+
+def last_rendition_name(name, renditions):
+    """Файл, который пул пишет последним: по нему судят о готовности."""
+
+    return rendition_name(name, renditions[-1], list(RENDITION_FORMATS)[-1])
+
+
+def renditions_ready(name, renditions):
+    """
+    Готовность хранится в общем кэше: рендишены строит пул одного
+    процесса, а отдают их все воркеры.
+    """
+
+    store = shared_cache()
+    key = READY_KEY.format(name)
+    ready = store.get(key)
+    if ready is None:
+        ready = default_storage.exists(last_rendition_name(name, renditions))
+        store.set(key, ready, timeout=None if ready else MISSING_TIMEOUT)
+    return ready
+
+
+def replace_file(name, content):
+    """
+    Пишет файл рядом под временным именем и подменяет им name:
+    читатель получает старый или новый файл целиком, но не пустой.
+    """
+
+    path = default_storage.path(name)
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    descriptor, temporary = tempfile.mkstemp(
+        dir=directory, prefix='.', suffix='.tmp'
+    )
+    try:
+        with os.fdopen(descriptor, 'wb') as file:
+            file.write(content)
+        os.chmod(temporary, settings.FILE_UPLOAD_PERMISSIONS or 0o644)
+        os.replace(temporary, path)
+    except BaseException:
+        os.remove(temporary)
+        raise
+
+
+def image_srcset(name, renditions, build_url):
+    """
+    Карта URL: оригинал и рендишены по форматам.
+    Пока рендишены не готовы, вместо них отдается оригинал.
+    """
+
+    original = build_url(default_storage.url(name))
+    ready = renditions_ready(name, renditions)
+    srcset = {'original': original}
+    for rendition in renditions:
+        srcset[rendition] = {
+            extension: (
+                build_url(default_storage.url(
+                    rendition_name(name, rendition, extension)
+                )) if ready else original
+            )
+            for extension in RENDITION_FORMATS
+        }
+    return srcset
+
+
+def render_renditions(name, renditions):
+    """Строит рендишены изображения и записывает их в хранилище."""
+
+    largest = max(RENDITION_SIZES[rendition] for rendition in renditions)
+    with default_storage.open(name, 'rb') as source:
+        image = Image.open(source)
+        # Для JPEG декодирует сразу в уменьшенном масштабе.
+        image.draft('RGB', (largest[0] * 2, largest[1] * 2))
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        else:
+            image = image.convert('RGB')
+    for rendition in renditions:
+        resized = ImageOps.fit(
+            image, RENDITION_SIZES[rendition], Image.LANCZOS
+        )
+        for extension, (image_format, params) in RENDITION_FORMATS.items():
+            buffer = BytesIO()
+            resized.save(buffer, image_format, **params)
+            replace_file(
+                rendition_name(name, rendition, extension),
+                buffer.getvalue()
+            )
+    shared_cache().set(READY_KEY.format(name), True, timeout=None)
+
+
+def delete_image(name):
+    """Удаляет из хранилища оригинал и все его рендишены."""
+
+    for rendition in RENDITION_SIZES:
+        for extension in RENDITION_FORMATS:
+            default_storage.delete(rendition_name(name, rendition, extension))
+    default_storage.delete(name)
+    shared_cache().delete(READY_KEY.format(name))
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                settings.IMAGE_WORKERS, thread_name_prefix='renditions'
+            )
+    return _executor
+
+
+def schedule_renditions(name, renditions, on_ready=None):
+    """Ставит построение рендишенов в фоновый пул процесса."""
+
+    shared_cache().delete(READY_KEY.format(name))
+
+    def job():
+        try:
+            render_renditions(name, renditions)
+            if on_ready is not None:
+                on_ready()
+        except Exception:
+            logger.exception('Не удалось построить рендишены %s', name)
+        finally:
+            connection.close()
+
+    return get_executor().submit(job)
@@ -0,0 +1,83 @@
+import bisect
+import threading
+import time
+
+from django.conf import settings
+from foodgram_backend.routers import primary_reads
+from recipes.models import Ingredient
+
+from .cache import INGREDIENTS_SCOPE, get_generations
+
+
+class IngredientIndex:
+    """
+    Процессный индекс ингредиентов для автодополнения.
+    Названия хранятся отсортированными в casefold-виде,
+    префикс ищется бинарным поиском, подстрока — проходом по списку.
+    Индекс перестраивается лениво при смене поколения справочника
+    или по истечении INGREDIENT_INDEX_TTL.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    def invalidate(self):
+        self._snapshot = None
+
+    def search(self, query, limit=None):
+        """
+        Возвращает строки (id, name, measurement_unit):
+        сначала совпадения по префиксу, затем по подстроке.
+        """
+
+        keys, rows = self._get_snapshot()
+        query = query.casefold()
+        if not query:
+            return rows[:limit]
+        start = bisect.bisect_left(keys, query)
+        end = bisect.bisect_left(
+            keys, query[:-1] + chr(ord(query[-1]) + 1), start
+        )
+        result = rows[start:end]
+        if limit is not None and len(result) >= limit:
+            return result[:limit]
+        for position, key in enumerate(keys):
+            if query in key and not start <= position < end:
+                result.append(rows[position])
+                if len(result) == limit:
+                    break
+        return result
+
+    def _get_snapshot(self):
+        generation, = get_generations(INGREDIENTS_SCOPE)
+        snapshot = self._snapshot
+        if not self._is_fresh(snapshot, generation):
+            with self._lock:
+                snapshot = self._snapshot
+                if not self._is_fresh(snapshot, generation):
+                    snapshot = self._build(generation)
+                    self._snapshot = snapshot
+        return snapshot[2], snapshot[3]
+
+    @staticmethod
+    def _is_fresh(snapshot, generation):
+        return (
+            snapshot is not None
+            and snapshot[0] == generation
+            and time.monotonic() - snapshot[1]
+            < settings.INGREDIENT_INDEX_TTL
+        )
+
+    @staticmethod
+    @primary_reads()
+    def _build(generation):
+        rows = sorted(
+            Ingredient.objects.values_list('id', 'name', 'measurement_unit'),
+            key=lambda row: (row[1].casefold(), row[0])
+        )
+        keys = [row[1].casefold() for row in rows]
+        return generation, time.monotonic(), keys, rows
+
+
+ingredient_index = IngredientIndex()
@@ -0,0 +1,129 @@
+import base64
+import io
+import multiprocessing
+import os
+import random
+import tempfile
+
+from api.views import UserViewSet
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.handlers.wsgi import WSGIRequest
+from django.core.management import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.test.client import (MULTIPART_CONTENT, RequestFactory,
+                                encode_multipart)
+from PIL import Image
+from rest_framework.test import force_authenticate
+from users.models import User
+
+BOUNDARY = 'BenchmarkBoundary'
+
+
+def make_jpeg(width, height, seed):
+    """JPEG из шума: сжимается плохо, как фотография."""
+
+    generator = random.Random(seed)
+    image = Image.frombytes(
+        'RGB', (width, height), generator.randbytes(width * height * 3)
+    )
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=92)
+    return buffer.getvalue()
+
+
+def build_body(path, image, target):
+    """Пишет тело запроса в файл, возвращает его Content-Type."""
+
+    if path == 'base64':
+        target.write(b'{"avatar": "data:image/jpeg;base64,')
+        target.write(base64.b64encode(image))
+        target.write(b'"}')
+        return 'application/json'
+    target.write(encode_multipart(BOUNDARY, {'avatar': io.BytesIO(image)}))
+    return MULTIPART_CONTENT.replace('BoUnDaRyStRiNg', BOUNDARY)
+
+
+def memory_kib(field):
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+
+
+def measure(body_path, content_type, user_id, results):
+    """
+    Выполняется в отдельном процессе. Тело читается из файла, как
+    из сокета; пик RSS (VmHWM) сбрасывается перед вызовом view,
+    так что прирост относится только к обработке загрузки.
+    """
+
+    user = User.objects.get(pk=user_id)
+    view = UserViewSet.as_view({'put': 'avatar'})
+    with open(body_path, 'rb') as body:
+        environ = RequestFactory()._base_environ(
+            PATH_INFO='/api/users/me/avatar/',
+            REQUEST_METHOD='PUT',
+            CONTENT_TYPE=content_type,
+            CONTENT_LENGTH=str(os.fstat(body.fileno()).st_size),
+        )
+        environ['wsgi.input'] = body
+        request = WSGIRequest(environ)
+        force_authenticate(request, user=user)
+        baseline = memory_kib('VmRSS')
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+        with transaction.atomic():
+            response = view(request)
+            transaction.set_rollback(True)
+        peak = memory_kib('VmHWM')
+    if response.status_code == 200:
+        default_storage.delete(
+            response.data['avatar'][len(settings.MEDIA_URL):]
+        )
+    results.put((response.status_code, (peak - baseline) / 1024))
+
+
+class Command(BaseCommand):
+
+    help = ('Измеряет пиковый прирост RSS процесса на одну загрузку '
+            'аватара в base64 (JSON) и файлом (multipart/form-data)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--width', type=int, default=4000)
+        parser.add_argument('--height', type=int, default=3000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--username', help='Пользователь, от имени которого загружать.'
+        )
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('pk')
+        if options['username']:
+            users = users.filter(username=options['username'])
+        user = users.first()
+        if user is None:
+            raise CommandError('Нет пользователя для загрузки')
+        image = make_jpeg(options['width'], options['height'], options['seed'])
+        self.stdout.write(
+            f'Картинка {options["width"]}x{options["height"]}, '
+            f'{len(image) / 2 ** 20:.1f} МиБ'
+        )
+        context = multiprocessing.get_context('fork')
+        results = context.Queue()
+        for path in ('base64', 'multipart'):
+            with tempfile.NamedTemporaryFile(suffix='.body') as body:
+                content_type = build_body(path, image, body)
+                body.flush()
+                # Соединение с БД не должно достаться дочернему процессу.
+                connections.close_all()
+                process = context.Process(
+                    target=measure,
+                    args=(body.name, content_type, user.pk, results)
+                )
+                process.start()
+                status, peak = results.get()
+                process.join()
+            self.stdout.write(
+                f'{path}: статус {status}, пик RSS +{peak:.1f} МиБ'
+            )
@@ -0,0 +1,59 @@
+import random
+import time
+
+from api.filters import IngredientFilter
+from api.ingredient_index import ingredient_index
+from django.core.management import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from recipes.models import Ingredient
+
+
+class Command(BaseCommand):
+
+    help = ('Сравнивает поиск ингредиентов через ORM (istartswith) '
+            'и через процессный префиксный индекс')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queries', type=int, default=500)
+        parser.add_argument('--limit', type=int, default=None)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        names = list(Ingredient.objects.values_list('name', flat=True))
+        if not names:
+            self.stdout.write(self.style.WARNING('Справочник пуст'))
+            return
+        generator = random.Random(options['seed'])
+        prefixes = [
+            name[:generator.randint(1, min(4, len(name)))]
+            for name in generator.choices(names, k=options['queries'])
+        ]
+        limit = options['limit']
+
+        def orm_search(prefix):
+            queryset = IngredientFilter(
+                {'name': prefix}, queryset=Ingredient.objects.all()
+            ).qs
+            return list(queryset[:limit] if limit else queryset)
+
+        def index_search(prefix):
+            return ingredient_index.search(prefix, limit)
+
+        ingredient_index.invalidate()
+        index_search('')
+        for title, search in (('ORM', orm_search), ('Индекс', index_search)):
+            timings = []
+            with CaptureQueriesContext(connection) as context:
+                for prefix in prefixes:
+                    started = time.perf_counter()
+                    search(prefix)
+                    timings.append(time.perf_counter() - started)
+            timings.sort()
+            self.stdout.write(
+                f'{title}: запросов {len(prefixes)}, '
+                f'p50 {timings[len(timings) // 2] * 1000:.3f} мс, '
+                f'p99 {timings[int(len(timings) * 0.99)] * 1000:.3f} мс, '
+                f'всего {sum(timings):.3f} с, '
+                f'SQL-запросов {len(context.captured_queries)}'
+            )
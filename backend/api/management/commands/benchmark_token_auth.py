@@ -0,0 +1,62 @@
+import time
+
+from api.authentication import CachedTokenAuthentication, token_cache
+from django.core.management import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIRequestFactory
+from users.models import User
+
+
+class Rollback(Exception):
+    """Откатывает созданный для замера токен."""
+
+
+class Command(BaseCommand):
+
+    help = ('Сравнивает число SQL-запросов и время аутентификации '
+            'по токену с кэшем снимков и без него')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(is_active=True).first()
+        if user is None:
+            self.stdout.write(self.style.WARNING('Нет пользователей'))
+            return
+        try:
+            with transaction.atomic():
+                token, _ = Token.objects.get_or_create(user=user)
+                try:
+                    self.compare(token.key, options['requests'])
+                finally:
+                    token_cache.delete(token.key)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def compare(self, key, count):
+        request = APIRequestFactory().get(
+            '/api/users/me/', HTTP_AUTHORIZATION=f'Token {key}'
+        )
+        for title, authentication in (
+            ('TokenAuthentication', TokenAuthentication()),
+            ('CachedTokenAuthentication', CachedTokenAuthentication()),
+        ):
+            timings = []
+            with CaptureQueriesContext(connection) as context:
+                for _ in range(count):
+                    started = time.perf_counter()
+                    authentication.authenticate(request)
+                    timings.append(time.perf_counter() - started)
+            timings.sort()
+            self.stdout.write(
+                f'{title}: запросов {count}, '
+                f'SQL-запросов на запрос '
+                f'{len(context.captured_queries) / count:.3f}, '
+                f'p50 {timings[len(timings) // 2] * 1000:.3f} мс, '
+                f'p99 {timings[int(len(timings) * 0.99)] * 1000:.3f} мс'
+            )
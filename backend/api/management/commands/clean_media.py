@@ -0,0 +1,200 @@
+import hashlib
+import os
+import shutil
+import time
+from functools import reduce
+from operator import or_
+
+from api.images import RENDITIONS_DIR
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.db.models import Q
+from recipes.models import MediaFile, Recipe
+from recipes.utils import batched
+from users.models import User
+
+MEDIA_SOURCES = (
+    (Recipe, 'image', 'recipes/images'),
+    (User, 'avatar', 'users'),
+)
+BATCH_SIZE = 500
+MIN_AGE_HOURS = 24
+
+
+def compact_key(value):
+    """8 байт вместо строки пути: на миллион файлов — десятки мегабайт."""
+
+    return hashlib.blake2b(value.encode(), digest_size=8).digest()
+
+
+def stem(name):
+    return os.path.splitext(name)[0]
+
+
+def rendition_stem(name):
+    """renditions/recipes/images/a.card.webp -> recipes/images/a"""
+
+    return name[len(RENDITIONS_DIR) + 1:].rsplit('.', 2)[0]
+
+
+def scan(root, directory):
+    """Обходит дерево без построения списков: (имя, stat) по одному."""
+
+    try:
+        entries = os.scandir(os.path.join(root, directory))
+    except FileNotFoundError:
+        return
+    with entries:
+        for entry in entries:
+            name = f'{directory}/{entry.name}'
+            if entry.is_dir(follow_symlinks=False):
+                yield from scan(root, name)
+            elif entry.is_file(follow_symlinks=False):
+                yield name, entry.stat(follow_symlinks=False)
+
+
+class Command(BaseCommand):
+
+    help = ('Удаляет или переносит в карантин файлы media, на которые '
+            'не ссылаются ни рецепты, ни аватары, вместе с рендишенами')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только посчитать, ничего не трогая.',
+        )
+        parser.add_argument(
+            '--min-age',
+            type=float,
+            default=MIN_AGE_HOURS,
+            help=('Не трогать файлы моложе стольких часов: они могут '
+                  'принадлежать незавершенной транзакции.'),
+        )
+        parser.add_argument(
+            '--quarantine',
+            help='Каталог, куда переносить файлы вместо удаления.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+        )
+
+    def handle(self, *args, **options):
+        self.root = settings.MEDIA_ROOT
+        self.quarantine = options['quarantine']
+        if self.quarantine and os.path.abspath(self.quarantine).startswith(
+            os.path.abspath(self.root) + os.sep
+        ):
+            raise CommandError('Карантин не может лежать внутри MEDIA_ROOT')
+        started = time.monotonic()
+        names, stems = self.referenced()
+        self.stdout.write(
+            f'Ссылок на файлы: {len(names)} '
+            f'({time.monotonic() - started:.2f} с)'
+        )
+        deadline = time.time() - options['min_age'] * 3600
+        self.scanned = self.young = removed = freed = 0
+        for batch in batched(
+            self.orphans(names, stems, deadline), options['batch_size']
+        ):
+            batch = self.recheck(batch)
+            if not options['dry_run']:
+                self.dispose(batch)
+            removed += len(batch)
+            freed += sum(size for _, size in batch)
+        elapsed = time.monotonic() - started
+        action = 'Будет удалено' if options['dry_run'] else (
+            'Перенесено в карантин' if self.quarantine else 'Удалено'
+        )
+        self.stdout.write(
+            f'Просмотрено файлов: {self.scanned}, '
+            f'моложе порога: {self.young}, '
+            f'{self.scanned / elapsed if elapsed else 0:.0f} файлов/с'
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'{action}: {removed} файлов, {freed / 2 ** 20:.1f} МиБ '
+            f'за {elapsed:.2f} с'
+        ))
+
+    @staticmethod
+    def referenced():
+        """Компактные множества путей оригиналов и их основ для рендишенов."""
+
+        names, stems = set(), set()
+        for model, field, _ in MEDIA_SOURCES:
+            queryset = model.objects.exclude(
+                **{f'{field}__isnull': True}
+            ).exclude(**{field: ''}).values_list(field, flat=True)
+            for name in queryset.iterator():
+                names.add(compact_key(name))
+                stems.add(compact_key(stem(name)))
+        return names, stems
+
+    def orphans(self, names, stems, deadline):
+        """Поток (имя, размер) файлов без ссылок старше deadline."""
+
+        trees = [
+            (directory, names, lambda name: name)
+            for _, _, directory in MEDIA_SOURCES
+        ]
+        trees.append((RENDITIONS_DIR, stems, rendition_stem))
+        for directory, keys, key_of in trees:
+            for name, stat in scan(self.root, directory):
+                self.scanned += 1
+                if compact_key(key_of(name)) in keys:
+                    continue
+                if stat.st_mtime >= deadline:
+                    self.young += 1
+                    continue
+                yield name, stat.st_size
+
+    @staticmethod
+    def recheck(batch):
+        """
+        Повторная проверка по базе: старый файл могли снова сослать
+        после того, как были собраны ссылки (одинаковое содержимое
+        хранится одним файлом, и его mtime не меняется).
+        """
+
+        if not batch:
+            return batch
+        originals = [name for name, _ in batch
+                     if not name.startswith(RENDITIONS_DIR + '/')]
+        rendition_stems = {rendition_stem(name) for name, _ in batch
+                           if name.startswith(RENDITIONS_DIR + '/')}
+        alive = set()
+        for model, field, _ in MEDIA_SOURCES:
+            conditions = [
+                Q(**{f'{field}__startswith': f'{name}.'})
+                for name in rendition_stems
+            ]
+            if originals:
+                conditions.append(Q(**{f'{field}__in': originals}))
+            for name in model.objects.filter(
+                reduce(or_, conditions)
+            ).values_list(field, flat=True).iterator():
+                alive.add(name)
+                alive.add(stem(name))
+        return [
+            (name, size) for name, size in batch
+            if name not in alive and (
+                not name.startswith(RENDITIONS_DIR + '/')
+                or rendition_stem(name) not in alive
+            )
+        ]
+
+    def dispose(self, batch):
+        for name, _ in batch:
+            source = os.path.join(self.root, name)
+            if self.quarantine:
+                target = os.path.join(self.quarantine, name)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.move(source, target)
+            else:
+                try:
+                    os.remove(source)
+                except FileNotFoundError:
+                    pass
+        MediaFile.objects.filter(name__in=[name for name, _ in batch]).delete()
@@ -0,0 +1,45 @@
+import time
+
+from api.images import (AVATAR_RENDITIONS, RECIPE_RENDITIONS,
+                        render_renditions, renditions_ready)
+from django.core.management import BaseCommand
+from recipes.models import Recipe
+from users.models import User
+
+
+class Command(BaseCommand):
+
+    help = ('Строит недостающие рендишены изображений рецептов '
+            'и аватаров, например после импорта')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Перестроить рендишены, даже если они уже есть.',
+        )
+
+    def handle(self, *args, **options):
+        sources = (
+            (Recipe.objects.exclude(image=''), 'image', RECIPE_RENDITIONS),
+            (User.objects.exclude(avatar='').exclude(avatar=None), 'avatar',
+             AVATAR_RENDITIONS),
+        )
+        started = time.monotonic()
+        built = failed = 0
+        for queryset, field, renditions in sources:
+            names = queryset.values_list(field, flat=True).distinct()
+            for name in names.iterator():
+                if not options['force'] and renditions_ready(name, renditions):
+                    continue
+                try:
+                    render_renditions(name, renditions)
+                except (OSError, ValueError) as error:
+                    failed += 1
+                    self.stderr.write(f'{name}: {error}')
+                    continue
+                built += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Построено: {built}, ошибок: {failed} '
+            f'за {time.monotonic() - started:.2f} с'
+        ))
@@ -1,6 +1,202 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 
 class LimitPagePagination(PageNumberPagination):
     page_size = 6
     page_size_query_param = 'limit'
+
+
+class KeysetPagination(BasePagination):
+    """
+    Пагинация по ключу сортировки (keyset) без COUNT(*) и OFFSET.
+    Позиция страницы передается непрозрачным курсором,
+    в котором закодированы значения полей сортировки крайнего объекта.
+    """
+
+    page_size = 6
+    page_size_query_param = 'limit'
+    cursor_query_param = 'cursor'
+    ordering = ('-pub_date', '-id')
+    invalid_cursor_message = 'Некорректный курсор.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset, view)
+        self.cursor = self.decode_cursor(request, queryset.model)
+        self.reverse = bool(self.cursor and self.cursor['r'])
+
+        ordering = (
+            tuple(self.invert(field) for field in self.ordering)
+            if self.reverse else self.ordering
+        )
+        queryset = queryset.order_by(*ordering)
+        if self.cursor:
+            queryset = queryset.filter(
+                self.get_position_filter(ordering, self.cursor['p'])
+            )
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if self.reverse:
+            self.page.reverse()
+            self.has_next = True
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = self.cursor is not None
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return page_size if page_size > 0 else self.page_size
+
+    def get_ordering(self, queryset, view):
+        """
+        Явная сортировка queryset имеет приоритет над сортировкой вьюсета.
+        """
+
+        if queryset.query.order_by:
+            return tuple(queryset.query.order_by)
+        return getattr(view, 'cursor_ordering', self.ordering)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    @staticmethod
+    def supports(queryset):
+        """
+        Ключом служат только поля модели. Аннотации вроде ранга поиска
+        (float) не годятся: близкие значения сравнивались бы с курсором
+        на точное равенство.
+        """
+
+        annotations = queryset.query.annotations
+        return not any(
+            field.lstrip('-').split('__')[0] in annotations
+            for field in queryset.query.order_by
+        )
+
+    @staticmethod
+    def invert(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    @staticmethod
+    def get_position_filter(ordering, position):
+        """
+        Собирает условие «строго после позиции» для составного ключа:
+        (a > x) OR (a = x AND b > y) OR ...
+        """
+
+        condition = Q()
+        equal = Q()
+        for field, value in zip(ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def get_position(self, instance):
+        position = []
+        for field in self.ordering:
+            value = instance
+            for attr in field.lstrip('-').split('__'):
+                value = getattr(value, attr)
+            if isinstance(value, datetime):
+                value = value.isoformat()
+            position.append(value)
+        return position
+
+    def encode_cursor(self, instance, reverse):
+        payload = json.dumps(
+            {'p': self.get_position(instance), 'r': int(reverse)},
+            separators=(',', ':')
+        )
+        cursor = base64.urlsafe_b64encode(payload.encode()).decode()
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            cursor
+        )
+
+    @staticmethod
+    def get_field(model, path):
+        for name in path.lstrip('-').split('__'):
+            field = model._meta.get_field(name)
+            model = field.related_model
+        return field
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            position, reverse = cursor['p'], cursor['r']
+        except (TypeError, ValueError, KeyError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if (not isinstance(position, list)
+                or len(position) != len(self.ordering)):
+            raise NotFound(self.invalid_cursor_message)
+        # Значения приводятся к типам полей здесь: подделанная позиция
+        # иначе упадет ошибкой 500 уже при выполнении запроса.
+        try:
+            position = [
+                self.get_field(model, field).to_python(value)
+                for field, value in zip(self.ordering, position)
+            ]
+        except (FieldDoesNotExist, ValidationError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if None in position:
+            raise NotFound(self.invalid_cursor_message)
+        return {'p': position, 'r': bool(reverse)}
+
+
+class LimitPageCursorPagination(BasePagination):
+    """
+    Постраничная пагинация page/limit по умолчанию.
+    Наличие параметра cursor (в том числе пустого) включает keyset-режим,
+    если сортировка идет по полям модели; выдача поиска, упорядоченная
+    по релевантности, всегда листается по номеру страницы.
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if (
+            KeysetPagination.cursor_query_param in request.query_params
+            and KeysetPagination.supports(queryset)
+        ):
+            self.paginator = KeysetPagination()
+        else:
+            self.paginator = LimitPagePagination()
+        return self.paginator.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
@@ -0,0 +1,186 @@
+import zlib
+
+from reportlab.pdfbase.ttfonts import TTFontFace, makeToUnicodeCMap
+
+PAGE_WIDTH = 595
+PAGE_HEIGHT = 842
+MARGIN = 50
+TITLE_SIZE = 16
+FONT_SIZE = 11
+LEADING = 16
+# Объекты 1 и 2 — каталог и дерево страниц, они пишутся последними.
+CATALOG_ID = 1
+PAGES_ID = 2
+SUBSET_SIZE = 256
+
+
+class StreamingPDF:
+    """
+    Потоковая запись PDF: каждая страница отдается, как только заполнена.
+    Шрифт TrueType встраивается подмножествами до 256 символов
+    (как это делает reportlab), подмножества, дерево страниц
+    и таблица xref дописываются в конце документа.
+    """
+
+    def __init__(self, font_path):
+        self.face = TTFontFace(font_path)
+        self.offset = 0
+        self.offsets = {}
+        self.next_id = PAGES_ID + 1
+        self.page_ids = []
+        self.subsets = []
+        self.subset_ids = []
+        self.codes = {}
+
+    def render(self, title, lines):
+        """Генератор байтов документа: заголовок и строки по порядку."""
+
+        yield self._write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        per_page = int((PAGE_HEIGHT - 2 * MARGIN) // LEADING) - 2
+        page = []
+        for line in lines:
+            page.append(line)
+            if len(page) == per_page:
+                yield self._page(title if not self.page_ids else None, page)
+                page = []
+        if page or not self.page_ids:
+            yield self._page(title if not self.page_ids else None, page)
+        for number in range(len(self.subsets)):
+            yield self._font(number)
+        kids = ' '.join(f'{page_id} 0 R' for page_id in self.page_ids)
+        yield self._object(PAGES_ID, (
+            f'<< /Type /Pages /Kids [{kids}] '
+            f'/Count {len(self.page_ids)} >>'
+        ).encode())
+        yield self._object(
+            CATALOG_ID, f'<< /Type /Catalog /Pages {PAGES_ID} 0 R >>'.encode()
+        )
+        yield self._xref()
+
+    def _reserve(self):
+        object_id = self.next_id
+        self.next_id += 1
+        return object_id
+
+    def _write(self, data):
+        self.offset += len(data)
+        return data
+
+    def _object(self, object_id, body):
+        self.offsets[object_id] = self.offset
+        return self._write(
+            b'%d 0 obj\n' % object_id + body + b'\nendobj\n'
+        )
+
+    def _stream(self, object_id, content, **extra):
+        data = zlib.compress(content)
+        entries = ''.join(f' /{key} {value}' for key, value in extra.items())
+        return self._object(object_id, (
+            f'<< /Length {len(data)} /Filter /FlateDecode{entries} >>\n'
+            'stream\n'
+        ).encode() + data + b'\nendstream')
+
+    def _encode(self, text):
+        """Разбивает текст на отрезки (номер подмножества, коды символов)."""
+
+        runs = []
+        for char in text:
+            codepoint = ord(char)
+            if codepoint not in self.face.charToGlyph:
+                codepoint = ord('?')
+            if codepoint not in self.codes:
+                if not self.subsets or len(self.subsets[-1]) == SUBSET_SIZE:
+                    # Код 0 в каждом подмножестве отведен под .notdef.
+                    self.subsets.append([0])
+                    self.subset_ids.append(self._reserve())
+                self.codes[codepoint] = (
+                    len(self.subsets) - 1, len(self.subsets[-1])
+                )
+                self.subsets[-1].append(codepoint)
+            number, code = self.codes[codepoint]
+            if runs and runs[-1][0] == number:
+                runs[-1][1].append(code)
+            else:
+                runs.append((number, [code]))
+        return runs
+
+    def _text(self, x, y, size, text, fonts):
+        operators = [f'BT {x} {y} Td']
+        for number, codes in self._encode(text):
+            fonts.add(number)
+            operators.append(
+                f'/F{number} {size} Tf <{bytes(codes).hex()}> Tj'
+            )
+        operators.append('ET')
+        return ' '.join(operators)
+
+    def _page(self, title, lines):
+        fonts = set()
+        y = PAGE_HEIGHT - MARGIN
+        content = []
+        if title is not None:
+            content.append(self._text(MARGIN, y, TITLE_SIZE, title, fonts))
+            y -= 2 * LEADING
+        for line in lines:
+            content.append(self._text(MARGIN, y, FONT_SIZE, line, fonts))
+            y -= LEADING
+        page_id, content_id = self._reserve(), self._reserve()
+        self.page_ids.append(page_id)
+        resources = ' '.join(
+            f'/F{number} {self.subset_ids[number]} 0 R'
+            for number in sorted(fonts)
+        )
+        return self._stream(
+            content_id, '\n'.join(content).encode()
+        ) + self._object(page_id, (
+            f'<< /Type /Page /Parent {PAGES_ID} 0 R '
+            f'/MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] '
+            f'/Resources << /Font << {resources} >> >> '
+            f'/Contents {content_id} 0 R >>'
+        ).encode())
+
+    def _font(self, number):
+        face = self.face
+        subset = self.subsets[number]
+        font_id = self.subset_ids[number]
+        prefix = ''
+        for _ in range(6):
+            number, letter = divmod(number, 26)
+            prefix = chr(ord('A') + letter) + prefix
+        name = f'{prefix}+{face.name.decode("latin-1")}'
+        file_id, descriptor_id, cmap_id = (
+            self._reserve(), self._reserve(), self._reserve()
+        )
+        font_file = face.makeSubset(subset)
+        widths = ' '.join(str(face.getCharWidth(code)) for code in subset)
+        bbox = ' '.join(map(str, face.bbox))
+        return b''.join((
+            self._stream(file_id, font_file, Length1=len(font_file)),
+            self._object(descriptor_id, (
+                f'<< /Type /FontDescriptor /FontName /{name} '
+                f'/Flags 4 /FontBBox [{bbox}] '
+                f'/ItalicAngle {face.italicAngle} /Ascent {face.ascent} '
+                f'/Descent {face.descent} /CapHeight {face.capHeight} '
+                f'/StemV {face.stemV} /MissingWidth {face.defaultWidth} '
+                f'/FontFile2 {file_id} 0 R >>'
+            ).encode()),
+            self._stream(cmap_id, makeToUnicodeCMap(name, subset).encode()),
+            self._object(font_id, (
+                f'<< /Type /Font /Subtype /TrueType /BaseFont /{name} '
+                f'/FirstChar 0 /LastChar {len(subset) - 1} '
+                f'/Widths [{widths}] /FontDescriptor {descriptor_id} 0 R '
+                f'/ToUnicode {cmap_id} 0 R >>'
+            ).encode()),
+        ))
+
+    def _xref(self):
+        size = self.next_id
+        entries = ['xref', f'0 {size}', '0000000000 65535 f ']
+        entries.extend(
+            f'{self.offsets[object_id]:010d} 00000 n '
+            for object_id in range(1, size)
+        )
+        return self._write(('\n'.join(entries) + (
+            f'\ntrailer\n<< /Size {size} /Root {CATALOG_ID} 0 R >>\n'
+            f'startxref\n{self.offset}\n%%EOF\n'
+        )).encode())
@@ -1,23 +1,33 @@
 from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
 from djoser.serializers import \
     UserCreateSerializer as DjoserUserCreateSerializer
 from djoser.serializers import UserSerializer as DjoserUserSerializer
 from drf_extra_fields.fields import Base64ImageField
+from foodgram_backend.metrics import TimedRepresentationMixin
+from recipes.constants import MAX_RECIPES_BATCH
 from recipes.models import Ingredient, Recipe, RecipeIngredient, ShortLink, Tag
+from recipes.utils import shift_shopping_lists_by
 from rest_framework import serializers
 from users.models import User
 
+from .catalog import ingredient_catalog, tag_catalog
+from .fields import ImageUploadField, SrcsetField
+from .images import AVATAR_RENDITIONS, RECIPE_RENDITIONS
+from .utils import get_recipes_limit
 
-class UserSerializer(DjoserUserSerializer):
+
+class UserSerializer(TimedRepresentationMixin, DjoserUserSerializer):
     """Сериализатор для получения пользователей."""
 
     is_subscribed = serializers.BooleanField(default=False)
     avatar = Base64ImageField(use_url=True, read_only=True)
+    avatar_srcset = SrcsetField(AVATAR_RENDITIONS, source='avatar')
 
     class Meta(DjoserUserSerializer.Meta):
         model = User
-        fields = ('email', 'id', 'username', 'first_name',
-                  'last_name', 'is_subscribed', 'password', 'avatar')
+        fields = ('email', 'id', 'username', 'first_name', 'last_name',
+                  'is_subscribed', 'password', 'avatar', 'avatar_srcset')
         extra_kwargs = {'password': {'write_only': True}}
 
 
@@ -38,16 +48,19 @@ class UserCreateSerializer(DjoserUserCreateSerializer):
         )
 
 
-class AvatarUserSerializer(serializers.ModelSerializer):
+class AvatarUserSerializer(
+    TimedRepresentationMixin, serializers.ModelSerializer
+):
 
-    avatar = Base64ImageField(use_url=True)
+    avatar = ImageUploadField(use_url=True)
+    avatar_srcset = SrcsetField(AVATAR_RENDITIONS, source='avatar')
 
     class Meta:
         model = User
-        fields = ('avatar',)
+        fields = ('avatar', 'avatar_srcset')
 
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(TimedRepresentationMixin, serializers.ModelSerializer):
     """Сериализатор тегов."""
 
     class Meta:
@@ -55,7 +68,9 @@ class TagSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(
+    TimedRepresentationMixin, serializers.ModelSerializer
+):
     """Сериализатор ингредиентов."""
 
     class Meta:
@@ -102,10 +117,13 @@ class RecipeIngredientCreateSerializer(serializers.ModelSerializer):
         return value
 
 
-class RecipeGetSerializer(serializers.ModelSerializer):
+class RecipeGetSerializer(
+    TimedRepresentationMixin, serializers.ModelSerializer
+):
     """Сериализатор для получения рецепта."""
 
     image = Base64ImageField(use_url=True, required=True)
+    image_srcset = SrcsetField(RECIPE_RENDITIONS, source='image')
     author = UserSerializer()
     tags = TagSerializer(many=True, required=True)
     ingredients = RecipeIngredientGetSerializer(
@@ -118,7 +136,8 @@ class RecipeGetSerializer(serializers.ModelSerializer):
         model = Recipe
         fields = (
             'id', 'tags', 'author', 'ingredients', 'is_favorited',
-            'is_in_shopping_cart', 'name', 'image', 'text', 'cooking_time'
+            'is_in_shopping_cart', 'name', 'image', 'image_srcset', 'text',
+            'cooking_time'
         )
         read_only_fields = ('id', 'author', 'tags', 'ingredients')
 
@@ -126,9 +145,9 @@ class RecipeGetSerializer(serializers.ModelSerializer):
 class RecipeCreateSerializer(serializers.ModelSerializer):
     """Сериализатор для создания и обновления рецепта."""
 
-    image = Base64ImageField(use_url=True, required=True)
-    tags = serializers.PrimaryKeyRelatedField(
-        many=True, queryset=Tag.objects.all(), required=True
+    image = ImageUploadField(use_url=True, required=True)
+    tags = serializers.ListField(
+        child=serializers.IntegerField(), required=True
     )
     ingredients = RecipeIngredientCreateSerializer(
         many=True,
@@ -137,20 +156,19 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
     )
 
     def set_ingredients_and_tags(self, recipe, ingredients, tags):
-        ingredients_ids = [ingredient.get('id') for ingredient in ingredients]
-        ingredients_obj = Ingredient.objects.filter(id__in=ingredients_ids)
-        ingredients_dict = {
-            ingredient.id: ingredient for ingredient in ingredients_obj
-        }
-        ingredients_list = [
+        """Id уже проверены по справочникам, объекты не загружаются."""
+
+        RecipeIngredient.objects.bulk_create(
             RecipeIngredient(
                 recipe=recipe,
-                ingredient=ingredients_dict[ingredient['id']],
+                ingredient_id=ingredient['id'],
                 amount=ingredient['amount']
             ) for ingredient in ingredients
-        ]
-        RecipeIngredient.objects.bulk_create(ingredients_list)
-        recipe.tags.set(tags)
+        )
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(recipe_id=recipe.pk, tag_id=tag)
+            for tag in tags
+        )
 
     def validate_cooking_time(self, value):
         if value == 0:
@@ -171,11 +189,7 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError(
                 'Необходимо добавить хотя бы один ингредиент'
             )
-        elif not all(
-            Ingredient.objects.filter(
-                id=ingredient.get('id')
-            ).exists() for ingredient in ingredients
-        ):
+        elif ingredient_catalog.missing(ingredients_list):
             raise serializers.ValidationError(
                 'Введенный ингредиент не существует'
             )
@@ -190,6 +204,11 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError('Поле tags обязательно.')
         elif len(tags) != len(set(tags)):
             raise serializers.ValidationError('Теги должны быть уникальными.')
+        missing = tag_catalog.missing(tags)
+        if missing:
+            raise serializers.ValidationError(
+                f'Теги не существуют: {", ".join(map(str, sorted(missing)))}.'
+            )
         return tags
 
     @transaction.atomic
@@ -198,6 +217,7 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         ingredients = validated_data.pop('ingredients')
         recipe = Recipe.objects.create(**validated_data)
         self.set_ingredients_and_tags(recipe, ingredients, tags)
+        recipe.update_search_vector()
         return recipe
 
     @transaction.atomic
@@ -208,14 +228,79 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError(
                 'Отсутствуют теги или ингредиенты'
             )
-        instance.ingredients.clear()
-        instance.tags.clear()
         for key, value in validated_data.items():
             setattr(instance, key, value)
         instance.save()
-        self.set_ingredients_and_tags(instance, ingredients, tags)
+        self.rows_touched = 1 + self.sync_ingredients(
+            instance, ingredients
+        ) + self.sync_tags(instance, tags)
+        if {'name', 'text'} & validated_data.keys():
+            instance.update_search_vector()
         return instance
 
+    @staticmethod
+    def sync_ingredients(recipe, ingredients):
+        """
+        Сводит ингредиенты рецепта к присланным минимальными изменениями:
+        удаление убранных, bulk_update измененных количеств, вставка
+        новых. Списки покупок сдвигаются только на разницу.
+        Возвращает число затронутых строк.
+        """
+
+        stored = {
+            ingredient_id: (pk, amount)
+            for pk, ingredient_id, amount in RecipeIngredient.objects.filter(
+                recipe=recipe
+            ).select_for_update().values_list('pk', 'ingredient_id', 'amount')
+        }
+        incoming = {
+            ingredient['id']: ingredient['amount']
+            for ingredient in ingredients
+        }
+        deltas = {}
+        removed, changed, added = [], [], []
+        for ingredient_id, (pk, amount) in stored.items():
+            if ingredient_id not in incoming:
+                removed.append(pk)
+                deltas[ingredient_id] = -amount
+            elif incoming[ingredient_id] != amount:
+                changed.append(RecipeIngredient(
+                    pk=pk, amount=incoming[ingredient_id]
+                ))
+                deltas[ingredient_id] = incoming[ingredient_id] - amount
+        for ingredient_id, amount in incoming.items():
+            if ingredient_id not in stored:
+                added.append(RecipeIngredient(
+                    recipe=recipe, ingredient_id=ingredient_id, amount=amount
+                ))
+                deltas[ingredient_id] = amount
+        if removed:
+            RecipeIngredient.objects.filter(pk__in=removed).delete()
+        if changed:
+            RecipeIngredient.objects.bulk_update(changed, ('amount',))
+        if added:
+            RecipeIngredient.objects.bulk_create(added)
+        return len(removed) + len(changed) + len(added) + (
+            shift_shopping_lists_by(recipe.pk, deltas)
+        )
+
+    @staticmethod
+    def sync_tags(recipe, tags):
+        through = Recipe.tags.through
+        stored = set(through.objects.filter(
+            recipe_id=recipe.pk
+        ).values_list('tag_id', flat=True))
+        removed, added = stored - set(tags), set(tags) - stored
+        if removed:
+            through.objects.filter(
+                recipe_id=recipe.pk, tag_id__in=removed
+            ).delete()
+        if added:
+            through.objects.bulk_create(
+                through(recipe_id=recipe.pk, tag_id=tag) for tag in added
+            )
+        return len(removed) + len(added)
+
     class Meta:
         model = Recipe
         fields = ('id', 'tags', 'author', 'ingredients',
@@ -223,34 +308,55 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         read_only_fields = ('id', 'author', 'tags', 'ingredients')
 
     def to_representation(self, instance):
+        # Ингредиенты ответа одним запросом, а не по запросу на строку.
+        prefetch_related_objects([instance], Prefetch(
+            'recipeingredients',
+            queryset=RecipeIngredient.objects.select_related('ingredient')
+        ), 'tags')
         return RecipeGetSerializer(
             instance,
             context={'request': self.context.get('request')}
         ).data
 
 
-class ShoppingCartFavoriteSerializer(serializers.ModelSerializer):
+class RecipeIdsSerializer(serializers.Serializer):
+    """Список id рецептов для пакетного добавления и удаления."""
+
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=MAX_RECIPES_BATCH
+    )
+
+
+class ShoppingCartFavoriteSerializer(
+    TimedRepresentationMixin, serializers.ModelSerializer
+):
     """Сериализатор для вывода рецептов в избранном и списке покупок."""
 
     image = Base64ImageField(max_length=None, use_url=True)
+    image_srcset = SrcsetField(RECIPE_RENDITIONS, source='image')
 
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_srcset', 'cooking_time')
 
 
-class FollowerSerializer(serializers.ModelSerializer):
+class FollowerSerializer(
+    TimedRepresentationMixin, serializers.ModelSerializer
+):
     """Сериализатор подписок."""
 
     is_subscribed = serializers.BooleanField(default=False)
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
+    avatar_srcset = SrcsetField(AVATAR_RENDITIONS, source='avatar')
 
     class Meta:
         model = User
         fields = (
-            'email', 'id', 'username', 'first_name',
-            'last_name', 'is_subscribed', 'recipes', 'recipes_count', 'avatar'
+            'email', 'id', 'username', 'first_name', 'last_name',
+            'is_subscribed', 'recipes', 'recipes_count', 'avatar',
+            'avatar_srcset'
         )
         read_only_fields = (
             'email', 'username', 'first_name', 'last_name',
@@ -258,16 +364,13 @@ class FollowerSerializer(serializers.ModelSerializer):
         )
 
     def get_recipes(self, obj):
-        limit = self.context['request'].query_params.get('recipes_limit')
-        query = obj.recipes.all()
-        if limit:
-            query = query[: int(limit)]
+        query = getattr(obj, 'recent_recipes', None)
+        if query is None:
+            limit = get_recipes_limit(self.context['request'].query_params)
+            query = obj.recipes.all()[:limit]
         recipes = ShoppingCartFavoriteSerializer(query, many=True)
         return recipes.data
 
-    def get_recipes_count(self, obj):
-        return Recipe.objects.filter(author=obj).count()
-
 
 class ShortLinkSerializer(serializers.ModelSerializer):
     """Сериализатор для короткой ссылки."""
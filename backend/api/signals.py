@@ -0,0 +1,287 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import (m2m_changed, post_delete, post_init,
+                                      post_save, pre_delete)
+from django.dispatch import receiver
+from django.utils import timezone
+from recipes.models import (FavoriteRecipe, Ingredient, Recipe,
+                            RecipeIngredient, ShoppingCart, ShortLink, Tag)
+from recipes.utils import (release_media, shift_media_references,
+                           shift_shopping_lists)
+from rest_framework.authtoken.models import Token
+from users.models import Follower, User
+
+from .authentication import token_cache
+from .cache import (INGREDIENTS_SCOPE, RECIPES_SCOPE, TAGS_SCOPE, auth_scope,
+                    bump_generation, profile_scope, short_link_cache,
+                    user_scope)
+from .catalog import ingredient_catalog, tag_catalog
+from .images import (AVATAR_RENDITIONS, RECIPE_RENDITIONS, delete_image,
+                     renditions_ready, schedule_renditions)
+from .ingredient_index import ingredient_index
+
+MEDIA_FIELDS = {Recipe: 'image', User: 'avatar'}
+# Поля пользователя, которые видны в рецептах как данные автора.
+AUTHOR_FIELDS = ('email', 'username', 'first_name', 'last_name', 'avatar')
+
+
+def bump_on_commit(scope):
+    transaction.on_commit(partial(bump_generation, scope))
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def invalidate_recipes(sender, **kwargs):
+    """Изменения рецептов и справочников сбрасывают общее поколение."""
+
+    bump_on_commit(RECIPES_SCOPE)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_tags(sender, **kwargs):
+    bump_on_commit(TAGS_SCOPE)
+    transaction.on_commit(tag_catalog.invalidate)
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_ingredients(sender, **kwargs):
+    """Индекс автодополнения перестроится при следующем поиске."""
+
+    bump_on_commit(INGREDIENTS_SCOPE)
+    transaction.on_commit(ingredient_index.invalidate)
+    transaction.on_commit(ingredient_catalog.invalidate)
+
+
+def invalidate_after_bulk(*scopes):
+    """
+    Для массовых операций в обход сигналов моделей (COPY, bulk_create):
+    после коммита сдвигает поколения областей и сбрасывает справочники
+    этого процесса; другие процессы заметят новое поколение сами.
+    """
+
+    for scope in scopes:
+        bump_on_commit(scope)
+    if TAGS_SCOPE in scopes:
+        transaction.on_commit(tag_catalog.invalidate)
+    if INGREDIENTS_SCOPE in scopes:
+        transaction.on_commit(ingredient_index.invalidate)
+        transaction.on_commit(ingredient_catalog.invalidate)
+
+
+@receiver(post_save, sender=FavoriteRecipe)
+@receiver(post_delete, sender=FavoriteRecipe)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_delete, sender=ShoppingCart)
+@receiver(post_save, sender=Follower)
+@receiver(post_delete, sender=Follower)
+def invalidate_user_flags(sender, instance, **kwargs):
+    """Избранное, корзина и подписки влияют только на выдачу их владельца."""
+
+    bump_on_commit(user_scope(instance.user_id))
+
+
+def author_fields(instance):
+    """
+    Загруженные значения AUTHOR_FIELDS; отложенные поля пропускаются.
+    У файла сравнивается имя, пустой аватар — пустая строка.
+    """
+
+    return {
+        field: getattr(instance.__dict__[field], 'name',
+                       instance.__dict__[field]) or ''
+        for field in AUTHOR_FIELDS if field in instance.__dict__
+    }
+
+
+@receiver(post_init, sender=User)
+def remember_author(sender, instance, **kwargs):
+    instance._author_fields = author_fields(instance)
+
+
+@receiver(post_save, sender=User)
+def invalidate_author(sender, instance, created, **kwargs):
+    """
+    Данные автора вложены в его рецепты. Поколения сдвигаются, только
+    если изменилось видимое в рецептах поле и рецепты у него есть:
+    регистрация, вход и смена пароля кэш рецептов не трогают.
+    """
+
+    stored, current = instance._author_fields, author_fields(instance)
+    instance._author_fields = current
+    if created or all(
+        field in stored and stored[field] == value
+        for field, value in current.items()
+    ):
+        return
+    if not Recipe.objects.filter(author_id=instance.pk).exists():
+        return
+    bump_on_commit(RECIPES_SCOPE)
+    bump_on_commit(profile_scope(instance.pk))
+
+
+@receiver(pre_delete, sender=User)
+def release_user_counters(sender, instance, **kwargs):
+    """
+    Каскад удаления пользователя минует пути API: счетчики другой
+    стороны и чужие списки покупок с его рецептами правятся здесь,
+    в той же транзакции.
+    """
+
+    Recipe.objects.filter(favorite__user=instance).update(
+        favorites_count=F('favorites_count') - 1
+    )
+    Recipe.objects.filter(shopping_cart__user=instance).update(
+        in_carts_count=F('in_carts_count') - 1
+    )
+    User.objects.filter(following__user=instance).update(
+        followers_count=F('followers_count') - 1
+    )
+    shift_shopping_lists(
+        -1, instance.recipes.values_list('pk', flat=True)
+    )
+
+
+def bump_auth(user_id):
+    """
+    Сдвиг сразу — чтобы этот же процесс не пустил по старому снимку,
+    и после коммита — чтобы не остался снимок, прочитанный другим
+    процессом до коммита.
+    """
+
+    bump_generation(auth_scope(user_id))
+    bump_on_commit(auth_scope(user_id))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_auth(sender, instance, update_fields=None, **kwargs):
+    """
+    Смена пароля, деактивация, удаление и любые правки профиля
+    устаревают снимки пользователя в кэше аутентификации.
+    """
+
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    bump_auth(instance.pk)
+
+
+@receiver(post_delete, sender=Token)
+def evict_token(sender, instance, **kwargs):
+    """Выход через token/logout действует сразу."""
+
+    token_cache.delete(instance.key)
+    bump_auth(instance.user_id)
+
+
+@receiver(post_save, sender=ShortLink)
+@receiver(post_delete, sender=ShortLink)
+def evict_short_link(sender, instance, **kwargs):
+    """
+    Вытесняет код из LRU текущего процесса. Коды выдаются по первичному
+    ключу и не переиспользуются, поэтому в других процессах запись
+    может лишь устареть, но не указать на чужой рецепт.
+    """
+
+    if instance.short_link:
+        short_link_cache.delete(instance.short_link)
+
+
+def recipe_renditions_ready(recipe_id):
+    """Готовые рендишены меняют выдачу: сдвигаем ETag и поколение."""
+
+    Recipe.objects.filter(pk=recipe_id).update(updated_at=timezone.now())
+    bump_generation(RECIPES_SCOPE)
+
+
+def avatar_renditions_ready(user_id):
+    bump_generation(RECIPES_SCOPE)
+    bump_generation(profile_scope(user_id))
+
+
+@receiver(post_save, sender=Recipe)
+def render_recipe_image(sender, instance, **kwargs):
+    """Рендишены нового изображения строятся в фоне после коммита."""
+
+    name = instance.image.name
+    if name and not renditions_ready(name, RECIPE_RENDITIONS):
+        transaction.on_commit(partial(
+            schedule_renditions, name, RECIPE_RENDITIONS,
+            partial(recipe_renditions_ready, instance.pk)
+        ))
+
+
+@receiver(post_save, sender=User)
+def render_avatar(sender, instance, update_fields=None, **kwargs):
+    name = instance.avatar.name
+    if update_fields and 'avatar' not in update_fields:
+        return
+    if name and not renditions_ready(name, AVATAR_RENDITIONS):
+        transaction.on_commit(partial(
+            schedule_renditions, name, AVATAR_RENDITIONS,
+            partial(avatar_renditions_ready, instance.pk)
+        ))
+
+
+def update_media_references(added=(), removed=()):
+    """Файлы, на которые не осталось ссылок, удаляются после коммита."""
+
+    released = shift_media_references(added, removed)
+    if released:
+        transaction.on_commit(partial(release_media, released, delete_image))
+
+
+def media_name(instance):
+    """
+    Имя файла без обращения к отложенному полю:
+    None значит, что поле не загружалось.
+    """
+
+    field = MEDIA_FIELDS[type(instance)]
+    if field not in instance.__dict__:
+        return None
+    if instance.pk is None:
+        # Несохраненный объект: файл еще не получил имя в хранилище.
+        return ''
+    value = instance.__dict__[field]
+    return getattr(value, 'name', value) or ''
+
+
+@receiver(post_init, sender=Recipe)
+@receiver(post_init, sender=User)
+def remember_media(sender, instance, **kwargs):
+    instance._stored_media = media_name(instance)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=User)
+def count_media_references(sender, instance, update_fields=None, **kwargs):
+    """Замена файла переносит ссылку со старого имени на новое."""
+
+    field = MEDIA_FIELDS[sender]
+    if update_fields is not None and field not in update_fields:
+        return
+    stored, name = instance._stored_media, media_name(instance)
+    if stored is None or name is None or name == stored:
+        return
+    update_media_references((name,), (stored,))
+    instance._stored_media = name
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=User)
+def release_deleted_media(sender, instance, **kwargs):
+    name = media_name(instance)
+    if name:
+        update_media_references(removed=(name,))
@@ -0,0 +1,875 @@
+import base64
+import json
+import os
+import shutil
+import tempfile
+from io import BytesIO, StringIO
+from unittest import skipUnless
+from urllib.parse import parse_qsl, urlsplit
+
+from django.conf import settings
+from django.contrib.auth.models import update_last_login
+from django.core.cache import cache, caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F, Sum
+from django.test import TestCase, override_settings
+from foodgram_backend.storage import content_storage
+from PIL import Image
+from recipes.constants import SHORT_LINK_ALPHABET
+from recipes.models import (Ingredient, MediaFile, Recipe, RecipeIngredient,
+                            ShoppingListItem, ShortLink, Tag)
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed, NotFound
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from users.models import Follower, User
+
+from .authentication import CachedTokenAuthentication, token_cache
+from .cache import (RECIPES_SCOPE, STATS_KEY, auth_scope, bump_generation,
+                    get_generations, get_stats, record_stat, shared_cache)
+from .images import (READY_KEY, RECIPE_RENDITIONS, RENDITION_FORMATS,
+                     RENDITIONS_DIR, render_renditions, rendition_name,
+                     renditions_ready)
+from .pagination import KeysetPagination, LimitPageCursorPagination
+
+RECIPES_COUNT = 210
+INGREDIENTS_PER_RECIPE = 3
+
+
+class RecipeQueryCountTest(TestCase):
+    """Число запросов списка и карточки рецепта не зависит от их размера."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create_user(
+            username='reader', email='reader@example.com',
+            first_name='Читатель', last_name='Читатель'
+        )
+        cls.followed = User.objects.create_user(
+            username='followed', email='followed@example.com',
+            first_name='Автор', last_name='Автор'
+        )
+        cls.stranger = User.objects.create_user(
+            username='stranger', email='stranger@example.com',
+            first_name='Автор', last_name='Автор'
+        )
+        Follower.objects.create(user=cls.reader, author=cls.followed)
+        Tag.objects.bulk_create(
+            Tag(name=f'Тег {number}', slug=f'tag-{number}')
+            for number in range(3)
+        )
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент {number}', measurement_unit='г')
+            for number in range(20)
+        )
+        Recipe.objects.bulk_create(
+            Recipe(
+                name=f'Рецепт {number}', text='Описание', cooking_time=5,
+                author=(cls.followed, cls.stranger)[number % 2],
+                image='recipes/images/recipe.png'
+            )
+            for number in range(RECIPES_COUNT)
+        )
+        # SQLite не возвращает ключи из bulk_create.
+        tags = list(Tag.objects.order_by('pk'))
+        ingredients = list(Ingredient.objects.order_by('pk'))
+        recipes = list(Recipe.objects.order_by('pk'))
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(
+                recipe=recipe,
+                ingredient=ingredients[(number + shift) % len(ingredients)],
+                amount=shift + 1
+            )
+            for number, recipe in enumerate(recipes)
+            for shift in range(INGREDIENTS_PER_RECIPE)
+        )
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(recipe=recipe, tag=tag)
+            for recipe in recipes for tag in tags[:2]
+        )
+        cls.recipe = recipes[0]
+
+    def setUp(self):
+        # Ответы списка кэшируются, а считать нужно запросы к базе.
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+
+    def test_list_query_count_does_not_depend_on_page_size(self):
+        for size in (6, 50, 200):
+            with self.subTest(size=size):
+                # COUNT, страница, авторы, ингредиенты и теги.
+                with self.assertNumQueries(5):
+                    response = self.client.get(
+                        '/api/recipes/', {'limit': size}
+                    )
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.data['results']), size)
+                cache.clear()
+
+    def test_detail_query_count(self):
+        # Валидаторы ETag, рецепт, автор, ингредиенты и теги.
+        with self.assertNumQueries(5):
+            response = self.client.get(f'/api/recipes/{self.recipe.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            len(response.data['ingredients']), INGREDIENTS_PER_RECIPE
+        )
+
+    def test_is_subscribed_reflects_follow(self):
+        response = self.client.get('/api/recipes/', {'limit': 6})
+        subscribed = {
+            recipe['author']['id']: recipe['author']['is_subscribed']
+            for recipe in response.data['results']
+        }
+        self.assertEqual(
+            subscribed, {self.followed.pk: True, self.stranger.pk: False}
+        )
+
+    def test_anonymous_is_not_subscribed(self):
+        response = APIClient().get(f'/api/recipes/{self.recipe.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.data['author']['is_subscribed'])
+
+
+def make_cursor(position, reverse=0):
+    payload = json.dumps({'p': position, 'r': reverse})
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+class KeysetCursorTest(TestCase):
+    """Подделанный курсор — 404, а не ошибка сервера."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com',
+            first_name='Читатель', last_name='Читатель'
+        )
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Автор', last_name='Автор'
+        )
+        Follower.objects.create(user=cls.user, author=cls.author)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_tampered_positions(self):
+        for url, position in (
+            ('/api/recipes/', ['вчера', 1]),
+            ('/api/recipes/', ['2024-01-01T00:00:00+00:00', 'один']),
+            ('/api/recipes/', [None, 1]),
+            ('/api/recipes/', [[1], {}]),
+            ('/api/users/subscriptions/', ['author', 'один']),
+        ):
+            with self.subTest(url=url, position=position):
+                response = self.client.get(
+                    url, {'cursor': make_cursor(position)}
+                )
+                self.assertEqual(response.status_code, 404)
+
+    def test_valid_positions(self):
+        for url, position in (
+            ('/api/recipes/', ['2024-01-01T00:00:00+00:00', 1]),
+            ('/api/users/subscriptions/', ['author', self.author.pk]),
+        ):
+            with self.subTest(url=url):
+                response = self.client.get(
+                    url, {'cursor': make_cursor(position)}
+                )
+                self.assertEqual(response.status_code, 200)
+
+
+class AnnotatedOrderingPaginationTest(TestCase):
+    """
+    Выдача, упорядоченная по аннотации (как поиск по релевантности),
+    листается по страницам и с параметром cursor.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Автор', last_name='Автор'
+        )
+        for number in range(8):
+            recipe = Recipe.objects.create(
+                name=f'Борщ {number}', text='Свекла и капуста',
+                cooking_time=number % 3 + 1, author=author,
+                image='recipes/images/recipe.png'
+            )
+            recipe.update_search_vector()
+
+    def paginate(self, params):
+        queryset = Recipe.objects.annotate(
+            search_rank=F('cooking_time') * 0.5
+        ).order_by('-search_rank', '-pub_date', '-id')
+        paginator = LimitPageCursorPagination()
+        request = Request(APIRequestFactory().get('/api/recipes/', params))
+        page = paginator.paginate_queryset(queryset, request)
+        return page, paginator.get_paginated_response([]).data['next']
+
+    def test_second_page_through_cursor(self):
+        first, next_link = self.paginate({'cursor': '', 'limit': 3})
+        self.assertIsNotNone(next_link)
+        params = dict(parse_qsl(
+            urlsplit(next_link).query, keep_blank_values=True
+        ))
+        self.assertIn('cursor', params)
+        second, _ = self.paginate(params)
+        self.assertEqual(len(second), 3)
+        self.assertFalse({recipe.pk for recipe in first}
+                         & {recipe.pk for recipe in second})
+
+    def test_keyset_rejects_annotation_cursor(self):
+        with self.assertRaises(NotFound):
+            KeysetPagination().paginate_queryset(
+                Recipe.objects.annotate(
+                    search_rank=F('cooking_time') * 0.5
+                ).order_by('-search_rank', '-id'),
+                Request(APIRequestFactory().get(
+                    '/api/recipes/', {'cursor': make_cursor([0.5, 1])}
+                ))
+            )
+
+    @skipUnless(connection.vendor == 'postgresql',
+                'Поиск использует возможности PostgreSQL')
+    def test_search_second_page_through_cursor(self):
+        client = APIClient()
+        response = client.get(
+            '/api/recipes/', {'search': 'борщ', 'cursor': '', 'limit': 5}
+        )
+        self.assertEqual(response.status_code, 200)
+        response = client.get(response.data['next'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 3)
+
+
+class CascadeCountersTest(TestCase):
+    """Удаление пользователя возвращает счетчики другой стороны."""
+
+    def setUp(self):
+        self.author = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Автор', last_name='Автор'
+        )
+        self.reader = User.objects.create_user(
+            username='reader', email='reader@example.com',
+            first_name='Читатель', last_name='Читатель'
+        )
+        ingredient = Ingredient.objects.create(
+            name='Соль', measurement_unit='г'
+        )
+        self.recipe = Recipe.objects.create(
+            name='Рецепт', text='Описание', cooking_time=5,
+            author=self.author, image='recipes/images/recipe.png'
+        )
+        RecipeIngredient.objects.create(
+            recipe=self.recipe, ingredient=ingredient, amount=10
+        )
+        client = APIClient()
+        client.force_authenticate(self.reader)
+        for url in (
+            f'/api/recipes/{self.recipe.pk}/favorite/',
+            f'/api/recipes/{self.recipe.pk}/shopping_cart/',
+            f'/api/users/{self.author.pk}/subscribe/',
+        ):
+            self.assertEqual(client.post(url).status_code, 201)
+
+    def test_deleting_reader_releases_counters(self):
+        self.reader.delete()
+        self.recipe.refresh_from_db()
+        self.author.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 0)
+        self.assertEqual(self.recipe.in_carts_count, 0)
+        self.assertEqual(self.author.followers_count, 0)
+
+    def test_deleting_author_clears_other_shopping_lists(self):
+        self.assertTrue(
+            ShoppingListItem.objects.filter(user=self.reader).exists()
+        )
+        self.author.delete()
+        self.assertFalse(
+            ShoppingListItem.objects.filter(user=self.reader).exists()
+        )
+
+
+class ConditionalGetTest(TestCase):
+    """ETag рецепта и справочников меняется вместе с данными."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Автор', last_name='Автор'
+        )
+        cls.ingredient = Ingredient.objects.create(
+            name='Соль', measurement_unit='г'
+        )
+        cls.recipe = Recipe.objects.create(
+            name='Рецепт', text='Описание', cooking_time=5,
+            author=author, image='recipes/images/recipe.png'
+        )
+        RecipeIngredient.objects.create(
+            recipe=cls.recipe, ingredient=cls.ingredient, amount=10
+        )
+
+    def test_recipe_etag_follows_ingredient_rename(self):
+        url = f'/api/recipes/{self.recipe.pk}/'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ingredient.name = 'Морская соль'
+            self.ingredient.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json()['ingredients'][0]['name'], 'Морская соль'
+        )
+
+    def test_catalog_etag_follows_ingredient_change(self):
+        etag = self.client.get('/api/ingredients/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.create(name='Перец', measurement_unit='г')
+        self.assertNotEqual(self.client.get('/api/ingredients/')['ETag'], etag)
+
+    @override_settings(CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+        'shared': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    })
+    def test_process_local_generations_are_refused(self):
+        with self.assertRaises(ImproperlyConfigured):
+            get_generations('recipes')
+
+
+class CachedTokenAuthenticationTest(TestCase):
+    """Снимок токена сбрасывается изменением из любого процесса."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='reader', email='reader@example.com',
+            first_name='Читатель', last_name='Читатель'
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.addCleanup(token_cache.delete, self.token.key)
+        self.authentication = CachedTokenAuthentication()
+        self.authentication.authenticate_credentials(self.token.key)
+
+    def test_snapshot_is_served_without_queries(self):
+        with self.assertNumQueries(0):
+            user, token = self.authentication.authenticate_credentials(
+                self.token.key
+            )
+        self.assertEqual((user.pk, token.key), (self.user.pk, self.token.key))
+
+    def test_logout_in_another_process_is_applied(self):
+        # Другой воркер удалил токен: локальный снимок остался, изменилось
+        # только поколение в общем кэше.
+        Token.objects.filter(pk=self.token.pk)._raw_delete(Token.objects.db)
+        bump_generation(auth_scope(self.user.pk))
+        with self.assertRaises(AuthenticationFailed):
+            self.authentication.authenticate_credentials(self.token.key)
+
+    def test_deactivation_is_applied(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.authentication.authenticate_credentials(self.token.key)
+
+    @override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+    def test_snapshot_save_keeps_fields_changed_elsewhere(self):
+        self.addCleanup(shutil.rmtree, settings.MEDIA_ROOT, True)
+        # Вход в другом процессе пишет last_login без сброса снимка,
+        # профиль правят в обход сигналов: снимок отстает от базы.
+        update_last_login(None, User.objects.get(pk=self.user.pk))
+        User.objects.filter(pk=self.user.pk).update(last_name='Писатель')
+        fresh = User.objects.get(pk=self.user.pk)
+        buffer = BytesIO()
+        Image.new('RGB', (8, 8), 'red').save(buffer, 'PNG')
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        response = client.put('/api/users/me/avatar/', {
+            'avatar': 'data:image/png;base64,'
+            + base64.b64encode(buffer.getvalue()).decode()
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        user = User.objects.get(pk=self.user.pk)
+        self.assertTrue(user.avatar)
+        self.assertEqual(
+            (user.last_login, user.last_name),
+            (fresh.last_login, 'Писатель')
+        )
+
+    @override_settings(CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+        'shared': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    })
+    def test_process_local_cache_is_refused(self):
+        with self.assertRaises(ImproperlyConfigured):
+            CachedTokenAuthentication()
+
+
+class AuthorInvalidationTest(TestCase):
+    """Кэш рецептов сбрасывают только видимые в рецептах правки автора."""
+
+    def setUp(self):
+        self.author = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Автор', last_name='Автор'
+        )
+
+    def assertRecipesBumped(self, bumped, change):
+        before = get_generations(RECIPES_SCOPE)
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+        self.assertEqual(get_generations(RECIPES_SCOPE) != before, bumped)
+
+    def rename(self):
+        self.author.first_name = 'Новое имя'
+        self.author.save()
+
+    def test_signup_and_user_without_recipes_keep_cache(self):
+        self.assertRecipesBumped(False, lambda: APIClient().post(
+            '/api/users/', {
+                'username': 'newcomer', 'email': 'newcomer@example.com',
+                'first_name': 'Новичок', 'last_name': 'Новичок',
+                'password': 'Qwerty!12345'
+            }
+        ))
+        self.assertRecipesBumped(False, self.rename)
+
+    def test_author_changes(self):
+        Recipe.objects.create(
+            name='Рецепт', text='Описание', cooking_time=5,
+            author=self.author, image='recipes/images/recipe.png'
+        )
+        self.author.refresh_from_db()
+
+        def change_password():
+            self.author.set_password('Qwerty!12345')
+            self.author.save()
+
+        self.assertRecipesBumped(False, change_password)
+        self.assertRecipesBumped(False, lambda: self.author.save(
+            update_fields=('last_login',)
+        ))
+        self.assertRecipesBumped(True, self.rename)
+
+    def test_cache_stats_are_shared(self):
+        before = get_stats()['hits']
+        record_stat('hits')
+        self.assertEqual(
+            caches['shared'].get(STATS_KEY.format('hits')), before + 1
+        )
+
+
+class CartTestCase(TestCase):
+    """Автор с двумя рецептами и два читателя."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Автор', last_name='Автор'
+        )
+        cls.readers = [
+            User.objects.create_user(
+                username=f'reader{number}',
+                email=f'reader{number}@example.com',
+                first_name='Читатель', last_name='Читатель'
+            )
+            for number in range(2)
+        ]
+        cls.salt, cls.flour, cls.milk = (
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('Соль', 'Мука', 'Молоко')
+        )
+        cls.tags = [
+            Tag.objects.create(name=f'Тег {number}', slug=f'tag-{number}')
+            for number in range(2)
+        ]
+        cls.pancakes = cls.make_recipe(
+            'Блины', {cls.salt: 10, cls.flour: 20}
+        )
+        cls.porridge = cls.make_recipe(
+            'Каша', {cls.salt: 5, cls.milk: 7}
+        )
+
+    @classmethod
+    def make_recipe(cls, name, amounts):
+        recipe = Recipe.objects.create(
+            name=name, text='Описание', cooking_time=5,
+            author=cls.author, image='recipes/images/recipe.png'
+        )
+        for ingredient, amount in amounts.items():
+            RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=ingredient, amount=amount
+            )
+        recipe.tags.set(cls.tags[:1])
+        # Счетчик рецептов ведет API, здесь рецепт создан напрямую.
+        User.objects.filter(pk=cls.author.pk).update(
+            recipes_count=F('recipes_count') + 1
+        )
+        return recipe
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def add_to_cart(self, user, recipe):
+        response = self.client_for(user).post(
+            f'/api/recipes/{recipe.pk}/shopping_cart/'
+        )
+        self.assertEqual(response.status_code, 201)
+
+    def edit(self, recipe, amounts, tags):
+        return self.client_for(self.author).patch(
+            f'/api/recipes/{recipe.pk}/', {
+                'ingredients': [
+                    {'id': ingredient.pk, 'amount': amount}
+                    for ingredient, amount in amounts.items()
+                ],
+                'tags': [tag.pk for tag in tags],
+            }, format='json'
+        )
+
+    def assertShoppingListsMatchCarts(self):
+        """Материализованные списки равны свежему агрегату по корзинам."""
+
+        expected = {
+            (user_id, ingredient_id, total)
+            for user_id, ingredient_id, total in RecipeIngredient.objects
+            .filter(recipe__shopping_cart__isnull=False)
+            .values_list('recipe__shopping_cart__user', 'ingredient')
+            .annotate(total=Sum('amount'))
+        }
+        self.assertEqual(set(ShoppingListItem.objects.values_list(
+            'user', 'ingredient', 'amount'
+        )), expected)
+        return expected
+
+
+class ShoppingListTotalsTest(CartTestCase):
+    """Итоги списков покупок совпадают с корзинами после любых правок."""
+
+    def test_add_and_remove(self):
+        for reader in self.readers:
+            self.add_to_cart(reader, self.pancakes)
+        self.add_to_cart(self.readers[0], self.porridge)
+        self.assertIn(
+            (self.readers[0].pk, self.salt.pk, 15),
+            self.assertShoppingListsMatchCarts()
+        )
+        response = self.client_for(self.readers[0]).delete(
+            f'/api/recipes/{self.pancakes.pk}/shopping_cart/'
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assertShoppingListsMatchCarts()
+        self.assertFalse(ShoppingListItem.objects.filter(
+            user=self.readers[0], ingredient=self.flour
+        ).exists())
+
+    def test_edit_recipe_in_carts(self):
+        for reader in self.readers:
+            self.add_to_cart(reader, self.pancakes)
+        self.add_to_cart(self.readers[0], self.porridge)
+        # Соль меняет количество, мука убрана, молоко добавлено.
+        response = self.edit(
+            self.pancakes, {self.salt: 15, self.milk: 3}, self.tags
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertShoppingListsMatchCarts()
+        self.assertFalse(ShoppingListItem.objects.filter(
+            ingredient=self.flour
+        ).exists())
+
+    def test_delete_recipe_in_carts(self):
+        for reader in self.readers:
+            self.add_to_cart(reader, self.pancakes)
+        self.add_to_cart(self.readers[0], self.porridge)
+        response = self.client_for(self.author).delete(
+            f'/api/recipes/{self.pancakes.pk}/'
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(
+            self.assertShoppingListsMatchCarts(),
+            {(self.readers[0].pk, self.salt.pk, 5),
+             (self.readers[0].pk, self.milk.pk, 7)}
+        )
+
+
+class RowsTouchedTest(CartTestCase):
+    """X-Rows-Touched считает только реально записанные строки."""
+
+    def rows_touched(self, amounts, tags):
+        response = self.edit(self.pancakes, amounts, tags)
+        self.assertEqual(response.status_code, 200)
+        return int(response['X-Rows-Touched'])
+
+    def test_unchanged_update_writes_only_recipe(self):
+        self.assertEqual(
+            self.rows_touched({self.salt: 10, self.flour: 20}, self.tags[:1]),
+            1
+        )
+
+    def test_partial_update(self):
+        self.assertEqual(
+            self.rows_touched({self.salt: 12, self.flour: 20}, self.tags[:1]),
+            2
+        )
+        for reader in self.readers:
+            self.add_to_cart(reader, self.pancakes)
+        # Рецепт, количество соли и ее строка в двух списках покупок.
+        self.assertEqual(
+            self.rows_touched({self.salt: 15, self.flour: 20}, self.tags[:1]),
+            4
+        )
+        self.assertShoppingListsMatchCarts()
+
+    def test_full_update(self):
+        for reader in self.readers:
+            self.add_to_cart(reader, self.pancakes)
+        # Рецепт; два ингредиента удалены, один добавлен; тег заменен;
+        # в двух списках три позиции изменены, две из них удалены.
+        self.assertEqual(
+            self.rows_touched({self.milk: 3}, self.tags[1:]),
+            1 + 3 + 2 + 2 * 3 + 2 * 2
+        )
+        self.assertShoppingListsMatchCarts()
+
+
+class RelatedBatchTest(CartTestCase):
+    """Пакетные эндпоинты: итог по каждому id и счетчики рецептов."""
+
+    def batch(self, url, method, ids):
+        response = getattr(self.client_for(self.readers[0]), method)(
+            url, {'ids': ids}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        return [(row['id'], row['status']) for row in response.data['results']]
+
+    def counters(self, field):
+        return list(Recipe.objects.filter(
+            pk__in=(self.pancakes.pk, self.porridge.pk)
+        ).order_by('pk').values_list(field, flat=True))
+
+    def test_batches(self):
+        missing = self.porridge.pk + 1000
+        for url, field in (
+            ('/api/recipes/shopping_cart/', 'in_carts_count'),
+            ('/api/recipes/favorite/', 'favorites_count'),
+        ):
+            with self.subTest(url=url):
+                ids = [self.pancakes.pk, self.pancakes.pk, missing]
+                self.assertEqual(self.batch(url, 'post', ids), [
+                    (self.pancakes.pk, 'added'), (missing, 'not_found')
+                ])
+                ids = [self.pancakes.pk, self.porridge.pk]
+                self.assertEqual(self.batch(url, 'post', ids), [
+                    (self.pancakes.pk, 'exists'),
+                    (self.porridge.pk, 'added'),
+                ])
+                self.assertEqual(self.counters(field), [1, 1])
+                self.assertShoppingListsMatchCarts()
+                ids = [self.porridge.pk, missing]
+                self.assertEqual(self.batch(url, 'delete', ids), [
+                    (self.porridge.pk, 'removed'), (missing, 'not_found')
+                ])
+                self.assertEqual(self.batch(url, 'delete', ids[:1]), [
+                    (self.porridge.pk, 'absent')
+                ])
+                self.assertEqual(self.counters(field), [1, 0])
+                self.assertShoppingListsMatchCarts()
+
+    def test_invalid_payload(self):
+        response = self.client_for(self.readers[0]).post(
+            '/api/recipes/shopping_cart/', {'ids': []}, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class ShortLinkTest(TestCase):
+    """Коды коротких ссылок и переход по ним."""
+
+    def test_codes_are_unique_and_grow_with_pk(self):
+        base = len(SHORT_LINK_ALPHABET)
+        first, second = base ** 4, base ** 4 + base ** 5
+        pks = [
+            *range(1, 50_001),
+            *range(first - 5_000, first + 5_000),
+            *range(second - 100, second + 100),
+        ]
+        codes = {pk: ShortLink(pk=pk).generate_short_link() for pk in pks}
+        self.assertEqual(len(set(codes.values())), len(pks))
+        for pk, code in codes.items():
+            expected = 4 if pk <= first else 5 if pk <= second else 6
+            self.assertEqual(len(code), expected, pk)
+        self.assertLessEqual(
+            set(''.join(codes.values())), set(SHORT_LINK_ALPHABET)
+        )
+
+    def test_redirect(self):
+        author = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Автор', last_name='Автор'
+        )
+        recipe = Recipe.objects.create(
+            name='Рецепт', text='Описание', cooking_time=5,
+            author=author, image='recipes/images/recipe.png'
+        )
+        response = self.client.get(f'/api/recipes/{recipe.pk}/get-link/')
+        self.assertEqual(response.status_code, 200)
+        code = response.json()['short-link'].rsplit('/', 1)[1]
+        self.assertEqual(code, ShortLink.objects.get(recipe=recipe).short_link)
+        response = self.client.get(f'/s/{code}/')
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(
+            response['Location'].endswith(f'/recipes/{recipe.pk}/')
+        )
+        self.assertEqual(self.client.get('/s/unknown/').status_code, 404)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class MediaReferenceTest(TestCase):
+    """Общий файл удаляется, когда на него не осталось ссылок."""
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+
+    def test_last_reference_removes_file(self):
+        author = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Автор', last_name='Автор'
+        )
+        recipes = [
+            Recipe.objects.create(
+                name=f'Рецепт {number}', text='Описание', cooking_time=5,
+                author=author, image=ContentFile(b'image', 'recipe.png')
+            )
+            for number in range(2)
+        ]
+        name = recipes[0].image.name
+        self.assertEqual(recipes[1].image.name, name)
+        media = MediaFile.objects.get(name=name)
+        self.assertEqual(media.reference_count, 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            recipes[0].delete()
+        media.refresh_from_db()
+        self.assertEqual(media.reference_count, 1)
+        self.assertTrue(content_storage.exists(name))
+        with self.captureOnCommitCallbacks(execute=True):
+            recipes[1].delete()
+        self.assertFalse(MediaFile.objects.filter(name=name).exists())
+        self.assertFalse(content_storage.exists(name))
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class RenditionsTest(TestCase):
+    """Рендишены подменяются целиком, готовность видна всем процессам."""
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        buffer = BytesIO()
+        Image.new('RGB', (800, 600), 'red').save(buffer, 'PNG')
+        self.name = default_storage.save(
+            'recipes/images/red.png', ContentFile(buffer.getvalue())
+        )
+        shared_cache().delete(READY_KEY.format(self.name))
+
+    def test_rerender_replaces_files_and_marks_ready_in_shared_cache(self):
+        self.assertFalse(renditions_ready(self.name, RECIPE_RENDITIONS))
+        render_renditions(self.name, RECIPE_RENDITIONS)
+        self.assertTrue(
+            shared_cache().get(READY_KEY.format(self.name))
+        )
+        target = rendition_name(self.name, 'card', 'webp')
+        first = os.stat(default_storage.path(target)).st_ino
+        render_renditions(self.name, RECIPE_RENDITIONS)
+        self.assertNotEqual(
+            os.stat(default_storage.path(target)).st_ino, first
+        )
+        directory = os.path.dirname(default_storage.path(target))
+        self.assertEqual(sorted(os.listdir(directory)), sorted(
+            os.path.basename(rendition_name(self.name, rendition, extension))
+            for rendition in RECIPE_RENDITIONS
+            for extension in RENDITION_FORMATS
+        ))
+        self.assertTrue(renditions_ready(self.name, RECIPE_RENDITIONS))
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class CleanMediaTest(TestCase):
+    """clean_media убирает только старые файлы без ссылок."""
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        author = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Автор', last_name='Автор'
+        )
+        Recipe.objects.create(
+            name='Рецепт', text='Описание', cooking_time=5,
+            author=author, image='recipes/images/kept.png'
+        )
+        self.kept = self.write('recipes/images/kept.png')
+        self.orphans = [
+            self.write('recipes/images/orphan.png'),
+            self.write(f'{RENDITIONS_DIR}/recipes/images/orphan.card.webp'),
+        ]
+        self.young = self.write('users/young.png', age=0)
+
+    @staticmethod
+    def write(name, age=48 * 3600):
+        path = os.path.join(settings.MEDIA_ROOT, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as file:
+            file.write(b'image')
+        mtime = os.path.getmtime(path) - age
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def clean(self, *args):
+        output = StringIO()
+        call_command('clean_media', *args, stdout=output)
+        return output.getvalue()
+
+    def test_dry_run_deletes_nothing(self):
+        output = self.clean('--dry-run')
+        self.assertIn('Будет удалено: 2 файлов', output)
+        for path in (self.kept, self.young, *self.orphans):
+            self.assertTrue(os.path.exists(path), path)
+
+    def test_removes_old_orphans_with_renditions(self):
+        self.assertIn('Удалено: 2 файлов', self.clean())
+        for path in self.orphans:
+            self.assertFalse(os.path.exists(path), path)
+        self.assertTrue(os.path.exists(self.kept))
+        self.assertTrue(os.path.exists(self.young))
@@ -1,24 +1,47 @@
-from io import BytesIO
+from collections import defaultdict
 
-from django.db.models import Sum
-from recipes.models import RecipeIngredient
+from django.db.models import F, Window
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import RowNumber
+from recipes.models import Recipe
 
 
-def create_shopping_list(user):
-    """Функция формирует список ингредиентов в корзине."""
+def get_recipes_limit(query_params):
+    """Возвращает параметр recipes_limit или None, если он не задан."""
 
-    shopping_cart = RecipeIngredient.objects.filter(
-        recipe__shopping_cart__user=user
-    ).values('ingredient__name', 'ingredient__measurement_unit').annotate(
-        amount=Sum('amount')
-    )
-    shopping_list = ['Ваш список покупок:\n']
-    ingredient_list = (
-        (f'{ingredient["ingredient__name"]}: '
-         f'{ingredient["amount"]} '
-         f'{ingredient["ingredient__measurement_unit"]}')
-        for ingredient in shopping_cart
-    )
-    shopping_list.extend(ingredient_list)
+    limit = query_params.get('recipes_limit')
+    if limit and limit.isdigit():
+        return int(limit)
+    return None
 
-    return BytesIO('\n'.join(shopping_list).encode('utf-8'))
+
+def attach_recent_recipes(authors, limit=None):
+    """
+    Загружает рецепты авторов одним запросом и кладет их
+    в атрибут recent_recipes каждого автора.
+    При заданном limit каждому автору достается limit последних рецептов,
+    отобранных через ROW_NUMBER() OVER (PARTITION BY author).
+    """
+
+    if not authors:
+        return
+    recipes = Recipe.objects.filter(author__in=authors)
+    if limit is not None:
+        ranked = recipes.annotate(position=Window(
+            expression=RowNumber(),
+            partition_by=F('author_id'),
+            order_by=(F('pub_date').desc(), F('id').desc()),
+        )).order_by().values('id', 'position')
+        sql, params = ranked.query.sql_with_params()
+        recipes = Recipe.objects.filter(id__in=RawSQL(
+            f'SELECT ranked.id FROM ({sql}) AS ranked '
+            'WHERE ranked.position <= %s',
+            (*params, limit)
+        ))
+    grouped = defaultdict(list)
+    for recipe in recipes.only(
+        'id', 'name', 'image', 'cooking_time', 'author_id', 'pub_date'
+    ).order_by('-pub_date', '-id'):
+        grouped[recipe.author_id].append(recipe)
+    for author in authors:
+        author.recent_recipes = grouped[author.pk]
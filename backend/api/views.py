@@ -1,25 +1,45 @@
-from api.pagination import LimitPagePagination
+from api.pagination import LimitPageCursorPagination, LimitPagePagination
 from api.permissions import IsAuthorAdminAuthenticated
-from django.core.exceptions import ObjectDoesNotExist
-from django.db.models import Exists, OuterRef, Value
-from django.http import FileResponse
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Prefetch, Value
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet as DjoserUserViewSet
-from recipes.models import (FavoriteRecipe, Ingredient, Recipe, ShoppingCart,
-                            ShortLink, Tag)
+from foodgram_backend.metrics import ServerTimingMixin, timed, timed_phase
+from foodgram_backend.routers import primary_reads
+from recipes.models import (FavoriteRecipe, Ingredient, Recipe,
+                            RecipeIngredient, ShoppingCart, ShortLink, Tag)
+from recipes.utils import insert_user_recipes, shift_shopping_lists
 from rest_framework import status, viewsets
-from rest_framework.decorators import action, api_view
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.decorators import (action, api_view,
+                                       authentication_classes,
+                                       permission_classes)
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from users.models import Follower, User
 
-from .filters import IngredientFilter, RecipeFilter
+from .cache import (INGREDIENTS_SCOPE, RECIPES_SCOPE, TAGS_SCOPE,
+                    generation_timestamp, get_cached_response, get_generations,
+                    get_stats, profile_scope, response_cache_key,
+                    set_cached_response, short_link_cache, user_scope)
+from .conditional import catalog_validators, conditional_get, make_etag
+from .exporters import EXPORT_FORMATS, shopping_list_rows
+from .filters import RecipeFilter
+from .ingredient_index import ingredient_index
+from .negotiation import IgnoreFormatContentNegotiation
 from .serializers import (AvatarUserSerializer, FollowerSerializer,
                           IngredientSerializer, RecipeCreateSerializer,
-                          RecipeGetSerializer, ShoppingCartFavoriteSerializer,
-                          ShortLinkSerializer, TagSerializer, UserSerializer)
-from .utils import create_shopping_list
+                          RecipeGetSerializer, RecipeIdsSerializer,
+                          ShoppingCartFavoriteSerializer, ShortLinkSerializer,
+                          TagSerializer, UserSerializer)
+from .signals import bump_on_commit
+from .utils import attach_recent_recipes, get_recipes_limit
+
+RELATED_COUNTERS = {
+    FavoriteRecipe: 'favorites_count',
+    ShoppingCart: 'in_carts_count',
+}
 
 
 class TagViewSet(viewsets.ReadOnlyModelViewSet):
@@ -33,6 +53,18 @@ class TagViewSet(viewsets.ReadOnlyModelViewSet):
     permission_classes = (AllowAny,)
     pagination_class = None
 
+    def list(self, request, *args, **kwargs):
+        return conditional_get(
+            request, catalog_validators(TAGS_SCOPE),
+            super().list, *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return conditional_get(
+            request, catalog_validators(TAGS_SCOPE),
+            super().retrieve, *args, **kwargs
+        )
+
 
 class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     """
@@ -43,12 +75,41 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = (AllowAny,)
-    filter_backends = (DjangoFilterBackend, )
-    filterset_class = IngredientFilter
     pagination_class = None
 
+    def list(self, request, *args, **kwargs):
+        return conditional_get(
+            request, catalog_validators(INGREDIENTS_SCOPE), self.search
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return conditional_get(
+            request, catalog_validators(INGREDIENTS_SCOPE),
+            super().retrieve, *args, **kwargs
+        )
+
+    def search(self, request):
+        """
+        Поиск для автодополнения идет по процессному индексу:
+        сначала совпадения по началу названия, затем по подстроке.
+        """
+
+        limit = request.query_params.get('limit')
+        rows = ingredient_index.search(
+            request.query_params.get('name', ''),
+            int(limit) if limit and limit.isdigit() else None
+        )
+        serializer = self.get_serializer(
+            [
+                {'id': pk, 'name': name, 'measurement_unit': unit}
+                for pk, name, unit in rows
+            ],
+            many=True
+        )
+        return Response(serializer.data)
+
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(ServerTimingMixin, viewsets.ModelViewSet):
     """
     Вьюсет для рецептов.
     Просматривать рецепты могут все пользователи.
@@ -57,14 +118,38 @@ class RecipeViewSet(viewsets.ModelViewSet):
     """
 
     permission_classes = (IsAuthorAdminAuthenticated,)
-    pagination_class = LimitPagePagination
+    pagination_class = LimitPageCursorPagination
+    cursor_ordering = ('-pub_date', '-id')
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
 
+    @timed_phase('queryset')
     def get_queryset(self):
-        queryset = Recipe.objects.select_related('author').prefetch_related(
-            'ingredients'
-        ).all()
+        user = self.request.user if (
+            self.request.user.is_authenticated
+        ) else None
+        subscriptions = Follower.objects.filter(
+            user=user if user else Value(None),
+            author=OuterRef('pk')
+        )
+        queryset = Recipe.objects.defer('search_vector').prefetch_related(
+            Prefetch(
+                'author',
+                queryset=User.objects.annotate(
+                    is_subscribed=Exists(subscriptions)
+                )
+            ),
+            Prefetch(
+                'recipeingredients',
+                queryset=RecipeIngredient.objects.select_related(
+                    'ingredient'
+                )
+            ),
+            Prefetch('tags', queryset=Tag.objects.all()),
+        )
+        return self.annotate_user_flags(queryset)
+
+    def annotate_user_flags(self, queryset):
         user = self.request.user if (
             self.request.user.is_authenticated
         ) else None
@@ -76,14 +161,106 @@ class RecipeViewSet(viewsets.ModelViewSet):
             user=user if user else Value(None),
             recipe=OuterRef('pk')
         )
-        queryset = queryset.annotate(
+        return queryset.annotate(
             is_favorited=Exists(favorite),
             is_in_shopping_cart=Exists(shopping_cart),
         )
-        return queryset
 
+    def get_validators(self, pk):
+        """
+        Валидаторы рецепта без сериализации: время изменения рецепта,
+        версии тегов, ингредиентов и профиля автора, а для пользователя —
+        его флаги.
+        """
+
+        user = self.request.user
+        subscribed = Follower.objects.filter(
+            user=user if user.is_authenticated else Value(None),
+            author=OuterRef('author')
+        )
+        row = self.annotate_user_flags(Recipe.objects.filter(pk=pk)).annotate(
+            is_subscribed=Exists(subscribed)
+        ).values_list(
+            'updated_at', 'author_id', 'is_favorited',
+            'is_in_shopping_cart', 'is_subscribed'
+        ).first()
+        if row is None:
+            return None
+        updated_at, author_id, *flags = row
+        scopes = [TAGS_SCOPE, INGREDIENTS_SCOPE, profile_scope(author_id)]
+        if user.is_authenticated:
+            scopes.append(user_scope(user.pk))
+        generations = get_generations(*scopes)
+        etag = make_etag(pk, updated_at.isoformat(), *generations, *flags)
+        last_modified = max(
+            int(updated_at.timestamp()),
+            *map(generation_timestamp, generations)
+        )
+        return etag, last_modified
+
+    @primary_reads()
+    def retrieve(self, request, *args, **kwargs):
+        pk = kwargs[self.lookup_field]
+        validators = self.get_validators(pk) if pk.isdigit() else None
+        if validators is None:
+            return super().retrieve(request, *args, **kwargs)
+        return conditional_get(
+            request, validators, super().retrieve, *args, **kwargs
+        )
+
+    def list(self, request, *args, **kwargs):
+        """Список рецептов с кэшированием ответа по поколениям данных."""
+
+        key = response_cache_key(request, RECIPES_SCOPE)
+        data = get_cached_response(key)
+        if data is not None:
+            return Response(data, headers={'X-Cache': 'HIT'})
+        # В кэш под новым поколением нельзя класть данные реплики.
+        with primary_reads():
+            response = super().list(request, *args, **kwargs)
+        set_cached_response(key, response.data)
+        response['X-Cache'] = 'MISS'
+        return response
+
+    @action(
+        detail=False,
+        methods=('get',),
+        permission_classes=(IsAdminUser,),
+        url_path='cache-stats'
+    )
+    def cache_stats(self, request):
+        """Счетчики попаданий и промахов кэша списка рецептов."""
+
+        return Response(get_stats(), status=status.HTTP_200_OK)
+
+    @transaction.atomic
     def perform_create(self, serializer):
-        return serializer.save(author=self.request.user)
+        recipe = serializer.save(author=self.request.user)
+        User.objects.filter(pk=recipe.author_id).update(
+            recipes_count=F('recipes_count') + 1
+        )
+        return recipe
+
+    def update(self, request, *args, **kwargs):
+        """Число записанных строк — в заголовке X-Rows-Touched."""
+
+        response = super().update(request, *args, **kwargs)
+        if hasattr(self, 'rows_touched'):
+            response['X-Rows-Touched'] = self.rows_touched
+        return response
+
+    def perform_update(self, serializer):
+        serializer.save()
+        self.rows_touched = serializer.rows_touched
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        author_id = instance.author_id
+        shift_shopping_lists(-1, (instance.pk,))
+        instance.delete()
+        User.objects.filter(pk=author_id).update(
+            recipes_count=F('recipes_count') - 1
+        )
 
     def get_serializer_class(self):
 
@@ -92,42 +269,118 @@ class RecipeViewSet(viewsets.ModelViewSet):
         return RecipeCreateSerializer
 
     @staticmethod
-    def create_related_objects(request, model, serializer, pk):
-        """Статический метод для добавления
-        рецептов в список покупок и избранное.
+    def add_related(model, user, recipe_ids):
+        """
+        Добавляет рецепты в избранное или список покупок одним
+        INSERT ... ON CONFLICT DO NOTHING, возвращает id добавленных:
+        повторное нажатие не падает на уникальном ограничении.
         """
 
-        user = request.user
+        with transaction.atomic():
+            added = insert_user_recipes(model, user.pk, recipe_ids)
+            if added:
+                if model is ShoppingCart:
+                    shift_shopping_lists(1, added, (user.pk,))
+                counter = RELATED_COUNTERS[model]
+                Recipe.objects.filter(pk__in=added).update(
+                    **{counter: F(counter) + 1}
+                )
+                # Сырой INSERT не отправляет post_save.
+                bump_on_commit(user_scope(user.pk))
+        return added
+
+    @staticmethod
+    def remove_related(model, user, recipe_ids):
+        """Удаляет рецепты из избранного или списка покупок."""
+
+        with transaction.atomic():
+            removed = list(model.objects.select_for_update().filter(
+                user=user, recipe_id__in=recipe_ids
+            ).values_list('recipe_id', flat=True))
+            if removed:
+                if model is ShoppingCart:
+                    shift_shopping_lists(-1, removed, (user.pk,))
+                model.objects.filter(
+                    user=user, recipe_id__in=removed
+                ).delete()
+                counter = RELATED_COUNTERS[model]
+                Recipe.objects.filter(pk__in=removed).update(
+                    **{counter: F(counter) - 1}
+                )
+        return removed
+
+    def create_related_objects(self, request, model, serializer, pk):
+        """Метод для добавления рецепта в список покупок и избранное."""
+
         recipe = get_object_or_404(Recipe, pk=pk)
-        if model.objects.filter(
-            user=user,
-            recipe=recipe
-        ).exists():
+        if not self.add_related(model, request.user, (recipe.pk,)):
             return Response(
                 'Нельзя повторно добавить объект',
                 status=status.HTTP_400_BAD_REQUEST
             )
-        model.objects.create(user=user, recipe=recipe)
         return Response(
             serializer(recipe).data, status=status.HTTP_201_CREATED
         )
 
-    @staticmethod
-    def delete_related_objects(request, model, serializer, pk):
-        """Статический метод для удаления
-        рецептов из списка покупок и избранного.
-        """
+    def delete_related_objects(self, request, model, serializer, pk):
+        """Метод для удаления рецепта из списка покупок и избранного."""
 
-        user = request.user
         recipe = get_object_or_404(Recipe, pk=pk)
-        try:
-            model.objects.get(user=user, recipe=recipe).delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
-        except ObjectDoesNotExist:
+        if not self.remove_related(model, request.user, (recipe.pk,)):
             return Response(
                 'Необходимо сначала добавить объект',
                 status=status.HTTP_400_BAD_REQUEST
             )
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    def related_batch(self, request, model):
+        """
+        Добавление (POST) или удаление (DELETE) списка рецептов
+        с итогом по каждому id.
+        """
+
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipe_ids = list(dict.fromkeys(serializer.validated_data['ids']))
+        found = set(Recipe.objects.filter(
+            pk__in=recipe_ids
+        ).values_list('pk', flat=True))
+        if request.method == 'POST':
+            done = set(self.add_related(model, request.user, found))
+            outcomes = ('added', 'exists')
+        else:
+            done = set(self.remove_related(model, request.user, found))
+            outcomes = ('removed', 'absent')
+        return Response({'results': [
+            {
+                'id': recipe_id,
+                'status': 'not_found' if recipe_id not in found
+                else outcomes[recipe_id not in done]
+            }
+            for recipe_id in recipe_ids
+        ]}, status=status.HTTP_200_OK)
+
+    @action(
+        detail=False,
+        methods=('post', 'delete'),
+        permission_classes=(IsAuthenticated,),
+        url_path='shopping_cart'
+    )
+    def shopping_cart_batch(self, request):
+        """Вью для добавления и удаления рецептов списка покупок списком."""
+
+        return self.related_batch(request, ShoppingCart)
+
+    @action(
+        detail=False,
+        methods=('post', 'delete'),
+        permission_classes=(IsAuthenticated,),
+        url_path='favorite'
+    )
+    def favorite_batch(self, request):
+        """Вью для добавления и удаления рецептов избранного списком."""
+
+        return self.related_batch(request, FavoriteRecipe)
 
     @action(
         detail=True,
@@ -182,17 +435,30 @@ class RecipeViewSet(viewsets.ModelViewSet):
     @action(
         detail=False,
         methods=('get',),
-        permission_classes=(IsAuthenticated,)
+        permission_classes=(IsAuthenticated,),
+        content_negotiation_class=IgnoreFormatContentNegotiation
     )
     def download_shopping_cart(self, request):
-        """Вью для скачивания списка покупок в формате txt."""
+        """
+        Вью для скачивания списка покупок.
+        Формат задается параметром format: txt, csv, json или pdf.
+        """
 
-        file = create_shopping_list(request.user)
-        return FileResponse(
-            file,
-            as_attachment=True,
-            filename='shopping_cart.txt'
+        export_format = request.query_params.get('format', 'txt')
+        if export_format not in EXPORT_FORMATS:
+            return Response(
+                {'format': f'Доступные форматы: {", ".join(EXPORT_FORMATS)}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        content_type, export = EXPORT_FORMATS[export_format]
+        response = StreamingHttpResponse(
+            export(shopping_list_rows(request.user)),
+            content_type=content_type
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="shopping_cart.{export_format}"'
         )
+        return response
 
     @action(
         detail=True, methods=['get'],
@@ -204,27 +470,43 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
         recipe = self.get_object()
         short_link, created = ShortLink.objects.get_or_create(recipe=recipe)
+        short_link_cache.set(short_link.short_link, recipe.pk)
         serializer = ShortLinkSerializer(short_link)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
 
 @api_view(['GET'])
+@authentication_classes(())
+@permission_classes((AllowAny,))
 def redirect_short_link(request, short_link):
-    """Перенаправляет на соответствующий рецепт по короткой ссылке."""
+    """
+    Перенаправляет на соответствующий рецепт по короткой ссылке.
+    Код разрешается в id рецепта через процессный LRU-кэш,
+    при промахе — одним запросом по уникальному индексу.
+    """
 
-    short_link_obj = get_object_or_404(ShortLink, short_link=short_link)
+    recipe_id = short_link_cache.get(short_link)
+    if recipe_id is None:
+        try:
+            recipe_id = ShortLink.objects.values_list(
+                'recipe_id', flat=True
+            ).get(short_link=short_link)
+        except ShortLink.DoesNotExist:
+            raise Http404
+        short_link_cache.set(short_link, recipe_id)
     redirect_url = ('https://myfoodgramproject.zapto.org/'
-                    f'recipes/{short_link_obj.recipe.id}/')
+                    f'recipes/{recipe_id}/')
     return redirect(redirect_url)
 
 
-class UserViewSet(DjoserUserViewSet):
+class UserViewSet(ServerTimingMixin, DjoserUserViewSet):
     """Вьюсет кастомной модели пользователя."""
 
     serializer_class = UserSerializer
     pagination_class = LimitPagePagination
     lookup_field = 'id'
 
+    @timed_phase('queryset')
     def get_queryset(self):
         queryset = User.objects.all()
         user = self.request.user if (
@@ -264,7 +546,12 @@ class UserViewSet(DjoserUserViewSet):
                 'Вы пытаетесь подписаться повторно',
                 status=status.HTTP_400_BAD_REQUEST
             )
-        Follower.objects.create(user=user, author=author)
+        with transaction.atomic():
+            Follower.objects.create(user=user, author=author)
+            User.objects.filter(pk=author.pk).update(
+                followers_count=F('followers_count') + 1
+            )
+        author.is_subscribed = True
         serializer = FollowerSerializer(
             author,
             context={'request': request},
@@ -279,7 +566,11 @@ class UserViewSet(DjoserUserViewSet):
         author = get_object_or_404(User, id=id)
         author_del = Follower.objects.filter(user=user, author=author)
         if author_del.exists():
-            author_del.delete()
+            with transaction.atomic():
+                deleted, _ = author_del.delete()
+                User.objects.filter(pk=author.pk).update(
+                    followers_count=F('followers_count') - deleted
+                )
             return Response(
                 {'message': 'Вы отписались от автора'},
                 status=status.HTTP_204_NO_CONTENT
@@ -295,18 +586,32 @@ class UserViewSet(DjoserUserViewSet):
         detail=False,
         permission_classes=(IsAuthenticated,),
         serializer_class=FollowerSerializer,
+        pagination_class=LimitPageCursorPagination,
     )
     def subscriptions(self, request, *args, **kwargs):
         """Получение списка всех подписок на пользователей."""
 
-        following = self.get_queryset().filter(is_subscribed=True)
-        pages = self.paginate_queryset(following)
-        if pages is not None:
-            serializer = FollowerSerializer(
-                pages, many=True, context={'request': request}
+        with timed('queryset'):
+            following = Follower.objects.filter(
+                user=request.user
+            ).select_related('author').order_by(
+                'author__username', 'author_id'
             )
+        page = self.paginate_queryset(following)
+        authors = [
+            follower.author
+            for follower in (page if page is not None else following)
+        ]
+        for author in authors:
+            author.is_subscribed = True
+        attach_recent_recipes(
+            authors, get_recipes_limit(request.query_params)
+        )
+        serializer = FollowerSerializer(
+            authors, many=True, context={'request': request}
+        )
+        if page is not None:
             return self.get_paginated_response(serializer.data)
-        serializer = self.get_serializer(pages, many=True)
         return Response(serializer.data)
 
     @action(
@@ -334,7 +639,8 @@ class UserViewSet(DjoserUserViewSet):
 
         user = request.user
         if user.avatar:
-            user.avatar.delete()
+            # Файл удалится вместе с последней ссылкой на него.
+            user.avatar = None
             user.save()
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response(
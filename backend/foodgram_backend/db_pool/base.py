@@ -0,0 +1,269 @@
+import logging
+import os
+import threading
+import time
+
+import psycopg2
+from django.db.backends.base.base import NO_DB_ALIAS
+from django.db.backends.postgresql import base, creation
+from psycopg2 import extensions
+
+logger = logging.getLogger(__name__)
+
+POOL_DEFAULTS = {
+    'MAX_SIZE': 10,
+    'TIMEOUT': 5,
+    'CHECK_AFTER': 30,
+}
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    """Свободное соединение не освободилось за TIMEOUT секунд."""
+
+
+class ConnectionPool:
+    """
+    Ограниченный пул соединений psycopg2 одного процесса, общий для его
+    потоков. Соединение, пролежавшее без дела дольше CHECK_AFTER секунд,
+    перед выдачей проверяется запросом SELECT 1. После fork пул
+    начинается заново: сокеты родителя дочернему процессу не отдаются.
+    """
+
+    def __init__(self, max_size, timeout, check_after):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.check_after = check_after
+        self._condition = threading.Condition()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = []
+        self._in_use = 0
+        self.created = self.discarded = self.waits = self.timeouts = 0
+        self.wait_time = 0.0
+
+    def acquire(self, connect):
+        started = time.monotonic()
+        with self._condition:
+            if self._pid != os.getpid():
+                self._reset()
+            waited = False
+            while not self._idle and self._in_use >= self.max_size:
+                waited = True
+                remaining = self.timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolTimeout(
+                        f'Нет свободного соединения за {self.timeout} с'
+                    )
+                self._condition.wait(remaining)
+            if waited:
+                self.waits += 1
+                self.wait_time += time.monotonic() - started
+            connection, returned_at = (
+                self._idle.pop() if self._idle else (None, None)
+            )
+            self._in_use += 1
+        try:
+            if connection is not None and not self._healthy(
+                connection, returned_at
+            ):
+                self._close(connection)
+                connection = None
+            if connection is None:
+                connection = connect()
+                with self._condition:
+                    self.created += 1
+        except BaseException:
+            with self._condition:
+                self._in_use -= 1
+                self._condition.notify()
+            raise
+        return connection
+
+    def release(self, connection, reuse=True):
+        reusable = reuse and self._reset_session(connection)
+        with self._condition:
+            if self._pid != os.getpid():
+                return
+            self._in_use -= 1
+            if reusable:
+                self._idle.append((connection, time.monotonic()))
+            self._condition.notify()
+        if not reusable:
+            self._close(connection)
+
+    def drain(self):
+        """Закрывает простаивающие соединения; выданные не трогает."""
+
+        with self._condition:
+            idle = [] if self._pid != os.getpid() else self._idle
+            self._idle = []
+        for connection, _ in idle:
+            self._close(connection)
+
+    def stats(self):
+        with self._condition:
+            return {
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'max_size': self.max_size,
+                'created': self.created,
+                'discarded': self.discarded,
+                'waits': self.waits,
+                'wait_time': self.wait_time,
+                'timeouts': self.timeouts,
+            }
+
+    def _healthy(self, connection, returned_at):
+        if connection.closed:
+            return False
+        if time.monotonic() - returned_at < self.check_after:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+        except psycopg2.Error:
+            return False
+        return True
+
+    @staticmethod
+    def _reset_session(connection):
+        """Откатывает незавершенную транзакцию; False — соединение негодно."""
+
+        if connection.closed:
+            return False
+        status = connection.get_transaction_status()
+        if status == extensions.TRANSACTION_STATUS_IDLE:
+            return True
+        if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        try:
+            connection.rollback()
+        except psycopg2.Error:
+            return False
+        return True
+
+    def _close(self, connection):
+        with self._condition:
+            self.discarded += 1
+        try:
+            connection.close()
+        except psycopg2.Error:
+            logger.debug('Соединение уже закрыто', exc_info=True)
+
+
+def pool_key(alias, conn_params):
+    """
+    Пул определяется параметрами подключения, а не только алиасом:
+    при смене NAME (тестовая база) или хоста соединение из старого пула
+    привело бы не в ту базу.
+    """
+
+    return alias, tuple(sorted(
+        (name, repr(value)) for name, value in conn_params.items()
+    ))
+
+
+def get_pool(alias, settings_dict, conn_params):
+    key = pool_key(alias, conn_params)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            options = {**POOL_DEFAULTS, **settings_dict.get('POOL', {})}
+            pool = ConnectionPool(
+                options['MAX_SIZE'], options['TIMEOUT'],
+                options['CHECK_AFTER']
+            )
+            _pools[key] = pool
+    return pool
+
+
+def close_pools():
+    """Закрывает простаивающие соединения всех пулов процесса."""
+
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.drain()
+
+
+def pool_stats():
+    """Статистика пулов процесса по алиасам баз для слоя метрик."""
+
+    with _pools_lock:
+        pools = list(_pools.items())
+    stats = {}
+    for (alias, _), pool in pools:
+        total = stats.setdefault(alias, {})
+        for field, value in pool.stats().items():
+            total[field] = total.get(field, 0) + value
+    return stats
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    """
+    CREATE/DROP DATABASE не проходят, пока к базе подключены
+    простаивающие соединения пула.
+    """
+
+    def _create_test_db(self, *args, **kwargs):
+        close_pools()
+        return super()._create_test_db(*args, **kwargs)
+
+    def _destroy_test_db(self, *args, **kwargs):
+        close_pools()
+        return super()._destroy_test_db(*args, **kwargs)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    PostgreSQL с пулом соединений: в конце запроса (проверка
+    close_if_unusable_or_obsolete) соединение возвращается в пул,
+    connect() берет готовое без рукопожатия. Явный close(), в том числе
+    из connections.close_all(), закрывает соединение и простаивающие
+    соединения его пула. Служебные подключения без базы не пулятся.
+    """
+
+    creation_class = DatabaseCreation
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = None
+        self.return_to_pool = False
+
+    def get_new_connection(self, conn_params):
+        if self.alias == NO_DB_ALIAS:
+            self.pool = None
+            return super().get_new_connection(conn_params)
+        self.pool = get_pool(self.alias, self.settings_dict, conn_params)
+        connection = self.pool.acquire(
+            lambda: super(DatabaseWrapper, self).get_new_connection(
+                conn_params
+            )
+        )
+        self.isolation_level = self.settings_dict['OPTIONS'].get(
+            'isolation_level', connection.isolation_level
+        )
+        return connection
+
+    def close_if_unusable_or_obsolete(self):
+        self.return_to_pool = True
+        try:
+            super().close_if_unusable_or_obsolete()
+        finally:
+            self.return_to_pool = False
+
+    def _close(self):
+        if self.connection is None:
+            return
+        if self.pool is None:
+            super()._close()
+            return
+        self.pool.release(self.connection, reuse=self.return_to_pool)
+        if not self.return_to_pool:
+            self.pool.drain()
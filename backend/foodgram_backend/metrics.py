@@ -0,0 +1,414 @@
+import glob
+import hmac
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.db import connections
+from django.http import Http404, HttpResponse
+
+from .db_pool.base import pool_stats
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+METHODS = ('GET', 'HEAD', 'OPTIONS', 'POST', 'PUT', 'PATCH', 'DELETE')
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+SERVER_TIMING_PHASES = ('auth', 'queryset', 'serialize', 'render')
+NO_TIMING = nullcontext()
+ROUTE_COUNTERS = (
+    ('db_queries_total', 'queries', 'SQL-запросы'),
+    ('db_query_seconds_total', 'query_seconds', 'Время SQL-запросов'),
+    ('serialization_seconds_total', 'serialize_seconds',
+     'Время to_representation сериализаторов'),
+    ('response_bytes_total', 'response_bytes', 'Размер ответов'),
+)
+
+# Замеры текущего запроса; None — запрос не измеряется.
+current_timings = ContextVar('current_timings', default=None)
+
+
+class RequestTimings:
+    """
+    Замеры одного запроса: время фаз и SQL всех баз. Экземпляр сам
+    служит обработчиком connection.execute_wrapper. detailed включает
+    фазы, нужные только для Server-Timing.
+    """
+
+    def __init__(self, detailed=False):
+        self.detailed = detailed
+        self.phases = {}
+        self.queries = 0
+        self.query_seconds = 0.0
+        self._depth = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.query_seconds += time.perf_counter() - started
+
+    @contextmanager
+    def phase(self, name):
+        """Вложенные замеры одной фазы учитываются один раз."""
+
+        depth = self._depth.get(name, 0)
+        self._depth[name] = depth + 1
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._depth[name] = depth
+            if not depth:
+                self.stop(name, started)
+
+    def stop(self, name, started):
+        self.phases[name] = (
+            self.phases.get(name, 0) + time.perf_counter() - started
+        )
+
+    def server_timing(self, total):
+        entries = [
+            f'{name};dur={self.phases[name] * 1000:.2f}'
+            for name in SERVER_TIMING_PHASES if name in self.phases
+        ]
+        entries.append(
+            f'db;desc="{self.queries} queries";'
+            f'dur={self.query_seconds * 1000:.2f}'
+        )
+        entries.append(f'total;dur={total * 1000:.2f}')
+        return ', '.join(entries)
+
+
+def timed(name):
+    """Фаза для Server-Timing; когда он выключен — пустой контекст."""
+
+    timings = current_timings.get()
+    if timings is None or not timings.detailed:
+        return NO_TIMING
+    return timings.phase(name)
+
+
+def timed_phase(name):
+    """Декоратор: весь вызов метода — фаза name."""
+
+    def decorator(method):
+        @wraps(method)
+        def wrapper(*args, **kwargs):
+            with timed(name):
+                return method(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class TimedRepresentationMixin:
+    """Учитывает to_representation сериализатора в фазе serialize."""
+
+    def to_representation(self, instance):
+        timings = current_timings.get()
+        if timings is None:
+            return super().to_representation(instance)
+        with timings.phase('serialize'):
+            return super().to_representation(instance)
+
+
+class ServerTimingMixin:
+    """
+    Фазы auth, queryset (фильтрация) и render представления для
+    Server-Timing; get_queryset вьюсетов размечается timed_phase.
+    """
+
+    def perform_authentication(self, request):
+        with timed('auth'):
+            super().perform_authentication(request)
+
+    def filter_queryset(self, queryset):
+        with timed('queryset'):
+            return super().filter_queryset(queryset)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(
+            request, response, *args, **kwargs
+        )
+        timings = current_timings.get()
+        if (
+            timings is not None and timings.detailed
+            and hasattr(response, 'add_post_render_callback')
+        ):
+            started = time.perf_counter()
+            response.add_post_render_callback(
+                lambda response: timings.stop('render', started)
+            )
+        return response
+
+
+def new_route():
+    return {
+        'buckets': [0] * (len(LATENCY_BUCKETS) + 1),
+        'seconds': 0.0,
+        'count': 0,
+        **{field: 0 for _, field, _ in ROUTE_COUNTERS},
+    }
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class MetricsStore:
+    """
+    Агрегаты процесса по маршруту и методу. С METRICS_DIR процесс
+    не чаще раза в METRICS_FLUSH_INTERVAL секунд атомарно переписывает
+    свой файл, а /metrics суммирует файлы всех воркеров gunicorn.
+    Счетчики завершившихся воркеров остаются в сумме, показатели пула
+    берутся только у живых.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        # Время старта в имени: новый процесс с тем же pid не затрет
+        # счетчики предшественника.
+        self._file = f'{self._pid}-{time.time_ns()}.json'
+        self._flushed = time.monotonic()
+        self.requests = {}
+        self.routes = {}
+
+    def record(self, view, method, status, seconds, timings, size):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            key = view, method, str(status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            route = self.routes.setdefault((view, method), new_route())
+            route['buckets'][bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            route['seconds'] += seconds
+            route['count'] += 1
+            route['queries'] += timings.queries
+            route['query_seconds'] += timings.query_seconds
+            route['serialize_seconds'] += timings.phases.get('serialize', 0)
+            route['response_bytes'] += size
+            due = (
+                settings.METRICS_DIR and time.monotonic() - self._flushed
+                >= settings.METRICS_FLUSH_INTERVAL
+            )
+        if due:
+            self.flush()
+
+    def snapshot(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            return {
+                'pid': self._pid,
+                'requests': [[*key, value]
+                             for key, value in self.requests.items()],
+                'routes': [[*key, dict(route, buckets=list(route['buckets']))]
+                           for key, route in self.routes.items()],
+                'pools': pool_stats(),
+            }
+
+    def flush(self):
+        directory = settings.METRICS_DIR
+        snapshot = self.snapshot()
+        path = os.path.join(directory, self._file)
+        temporary = f'{path}.{threading.get_ident()}.tmp'
+        with open(temporary, 'w') as file:
+            json.dump(snapshot, file)
+        os.replace(temporary, path)
+        self._flushed = time.monotonic()
+
+    def collect(self):
+        """Сумма по процессам: (requests, routes, pools)."""
+
+        if not settings.METRICS_DIR:
+            snapshots = [self.snapshot()]
+        else:
+            self.flush()
+            snapshots = []
+            for path in glob.glob(
+                os.path.join(settings.METRICS_DIR, '*.json')
+            ):
+                try:
+                    with open(path) as file:
+                        snapshots.append(json.load(file))
+                except (OSError, ValueError):
+                    continue
+        requests, routes, pools = {}, {}, {}
+        for snapshot in snapshots:
+            for *key, value in snapshot['requests']:
+                key = tuple(key)
+                requests[key] = requests.get(key, 0) + value
+            for view, method, route in snapshot['routes']:
+                total = routes.setdefault((view, method), new_route())
+                for field, value in route.items():
+                    if field == 'buckets':
+                        total[field] = [
+                            left + right
+                            for left, right in zip(total[field], value)
+                        ]
+                    else:
+                        total[field] += value
+            if snapshot['pid'] != os.getpid() and not pid_alive(
+                snapshot['pid']
+            ):
+                continue
+            for alias, stats in snapshot['pools'].items():
+                total = pools.setdefault(alias, {})
+                for field, value in stats.items():
+                    total[field] = total.get(field, 0) + value
+        return requests, routes, pools
+
+
+metrics = MetricsStore()
+
+
+def label(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"')
+
+
+def exposition():
+    """Метрики в текстовом формате Prometheus."""
+
+    requests, routes, pools = metrics.collect()
+    lines = [
+        '# HELP foodgram_http_requests_total Запросы по маршруту и статусу',
+        '# TYPE foodgram_http_requests_total counter',
+    ]
+    for (view, method, status), value in sorted(requests.items()):
+        lines.append(
+            f'foodgram_http_requests_total{{view="{label(view)}",'
+            f'method="{method}",status="{status}"}} {value}'
+        )
+    lines += [
+        '# HELP foodgram_http_request_duration_seconds Время ответа',
+        '# TYPE foodgram_http_request_duration_seconds histogram',
+    ]
+    for (view, method), route in sorted(routes.items()):
+        labels = f'view="{label(view)}",method="{method}"'
+        cumulative = 0
+        for bound, count in zip(
+            [*map(str, LATENCY_BUCKETS), '+Inf'], route['buckets']
+        ):
+            cumulative += count
+            lines.append(
+                f'foodgram_http_request_duration_seconds_bucket'
+                f'{{{labels},le="{bound}"}} {cumulative}'
+            )
+        lines.append(
+            f'foodgram_http_request_duration_seconds_sum{{{labels}}} '
+            f'{route["seconds"]}'
+        )
+        lines.append(
+            f'foodgram_http_request_duration_seconds_count{{{labels}}} '
+            f'{route["count"]}'
+        )
+    for name, field, description in ROUTE_COUNTERS:
+        lines += [
+            f'# HELP foodgram_{name} {description}',
+            f'# TYPE foodgram_{name} counter',
+        ]
+        for (view, method), route in sorted(routes.items()):
+            lines.append(
+                f'foodgram_{name}{{view="{label(view)}",method="{method}"}} '
+                f'{route[field]}'
+            )
+    fields = sorted({field for stats in pools.values() for field in stats})
+    for field in fields:
+        lines += [
+            f'# HELP foodgram_db_pool_{field} Пул соединений, живые процессы',
+            f'# TYPE foodgram_db_pool_{field} gauge',
+        ]
+        for alias, stats in sorted(pools.items()):
+            lines.append(
+                f'foodgram_db_pool_{field}{{alias="{label(alias)}"}} '
+                f'{stats.get(field, 0)}'
+            )
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    """Метрики для Prometheus; доступ по токену METRICS_TOKEN."""
+
+    token = settings.METRICS_TOKEN
+    if not token:
+        raise Http404
+    if not hmac.compare_digest(
+        request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {token}'
+    ):
+        return HttpResponse(status=403)
+    return HttpResponse(exposition(), content_type=CONTENT_TYPE)
+
+
+class MetricsMiddleware:
+    """
+    Время ответа, SQL (через execute_wrapper на всех базах), время
+    сериализации и размер ответа по имени маршрута и методу. Потоковые
+    ответы учитываются, когда отдан последний фрагмент. С SERVER_TIMING
+    разбивка запроса по фазам отдается в заголовке Server-Timing.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        timings = RequestTimings(settings.SERVER_TIMING)
+        wrapped = [connections[alias] for alias in connections]
+        for connection in wrapped:
+            connection.execute_wrappers.append(timings)
+
+        def finish(status, size):
+            for connection in wrapped:
+                connection.execute_wrappers.remove(timings)
+            match = request.resolver_match
+            metrics.record(
+                match.view_name if match else 'unresolved',
+                request.method if request.method in METHODS else 'other',
+                status, time.perf_counter() - started, timings, size
+            )
+
+        token = current_timings.set(timings)
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            finish(500, 0)
+            raise
+        finally:
+            current_timings.reset(token)
+        if timings.detailed:
+            response['Server-Timing'] = timings.server_timing(
+                time.perf_counter() - started
+            )
+        if response.streaming:
+            response.streaming_content = self.stream(
+                response.streaming_content, response.status_code, finish
+            )
+        else:
+            finish(response.status_code, len(response.content))
+        return response
+
+    @staticmethod
+    def stream(content, status, finish):
+        size = 0
+        try:
+            for chunk in content:
+                size += len(chunk)
+                yield chunk
+        finally:
+            finish(status, size)
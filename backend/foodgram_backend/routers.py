@@ -0,0 +1,182 @@
+import hashlib
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from api.cache import shared_cache
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+PRIMARY = 'default'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+PIN_COOKIE = 'primary_until'
+PIN_KEY = 'primary_until:{}'
+REPLICA_APPS = ('recipes', 'users')
+POSTGRES_LAG_SQL = (
+    'SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() '
+    'THEN 0 ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) '
+    'END'
+)
+
+# Разрешено ли читать с реплики в текущем запросе. Вне запросов
+# (команды, фоновые пулы) значение по умолчанию — только primary.
+read_from_replica = ContextVar('read_from_replica', default=False)
+
+
+@contextmanager
+def primary_reads():
+    """
+    Чтение только с primary. Нужно всему, что попадает в кэш под
+    поколением или отдается с ETag: поколение сдвигается сразу после
+    записи на primary, и отставшая реплика сохранила бы под новым
+    ключом старые данные. Работает и как декоратор.
+    """
+
+    token = read_from_replica.set(False)
+    try:
+        yield
+    finally:
+        read_from_replica.reset(token)
+
+
+def replica_aliases():
+    return [alias for alias in settings.DATABASES if alias != PRIMARY]
+
+
+class ReplicaLag:
+    """
+    Процессный замер отставания реплик. Реплика, отставшая больше
+    REPLICA_MAX_LAG секунд или не ответившая, исключается до следующего
+    замера через REPLICA_LAG_CHECK_INTERVAL секунд.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._checked = {}
+
+    def healthy(self, alias):
+        checked = self._checked.get(alias)
+        if not self._is_fresh(checked):
+            with self._lock:
+                checked = self._checked.get(alias)
+                if not self._is_fresh(checked):
+                    checked = time.monotonic(), self.measure(alias)
+                    self._checked[alias] = checked
+        lag = checked[1]
+        return lag is not None and lag <= settings.REPLICA_MAX_LAG
+
+    @staticmethod
+    def _is_fresh(checked):
+        return (
+            checked is not None
+            and time.monotonic() - checked[0]
+            < settings.REPLICA_LAG_CHECK_INTERVAL
+        )
+
+    @staticmethod
+    def measure(alias):
+        """Отставание в секундах или None, если реплика недоступна."""
+
+        connection = connections[alias]
+        if connection.vendor != 'postgresql':
+            return 0
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(POSTGRES_LAG_SQL)
+                lag, = cursor.fetchone()
+        except DatabaseError:
+            logger.warning('Реплика %s недоступна', alias, exc_info=True)
+            return None
+        return float(lag or 0)
+
+    def reset(self):
+        self._checked.clear()
+
+
+replica_lag = ReplicaLag()
+
+
+class ReplicaRouter:
+    """
+    Чтение моделей recipes и users в безопасных запросах уходит
+    на реплику, все остальное — на primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        if (
+            not read_from_replica.get()
+            or model._meta.app_label not in REPLICA_APPS
+            or connections[PRIMARY].in_atomic_block
+        ):
+            return PRIMARY
+        replicas = [
+            alias for alias in replica_aliases() if replica_lag.healthy(alias)
+        ]
+        return random.choice(replicas) if replicas else PRIMARY
+
+    def db_for_write(self, model, **hints):
+        # Запрос, который что-то записал, дальше читает свои данные.
+        read_from_replica.set(False)
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == PRIMARY
+
+
+def client_key(request):
+    """Ключ клиента для закрепления за primary: хэш токена авторизации."""
+
+    authorization = request.META.get('HTTP_AUTHORIZATION')
+    if not authorization:
+        return None
+    return PIN_KEY.format(hashlib.sha1(authorization.encode()).hexdigest())
+
+
+def pinned_until(request):
+    try:
+        return float(request.COOKIES.get(PIN_COOKIE, 0))
+    except ValueError:
+        return 0
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Разрешает чтение с реплик для безопасных запросов. После успешной
+    записи клиент REPLICA_STICKY_SECONDS читает с primary, чтобы видеть
+    свои изменения: по токену (в общем кэше, чтобы закрепление видели
+    все воркеры) и по cookie для анонимов.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        key = client_key(request)
+        now = time.time()
+        pinned = pinned_until(request) > now or (
+            key is not None and shared_cache().get(key, 0) > now
+        )
+        token = read_from_replica.set(
+            request.method in SAFE_METHODS and not pinned
+        )
+        try:
+            response = self.get_response(request)
+        finally:
+            read_from_replica.reset(token)
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            window = settings.REPLICA_STICKY_SECONDS
+            if key is not None:
+                shared_cache().set(key, now + window, timeout=window)
+            response.set_cookie(
+                PIN_COOKIE, str(now + window), max_age=window,
+                httponly=True, samesite='Lax'
+            )
+        return response
@@ -0,0 +1,63 @@
+import hashlib
+import os
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+HASH_CHUNK_SIZE = 64 * 1024
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Хранилище, где имя файла — sha256 содержимого в каталоге upload_to:
+    recipes/images/3f/a2/3fa2....jpeg. Повторная загрузка той же картинки
+    ничего не пишет и возвращает уже сохраненное имя, поэтому файл
+    по такому имени никогда не меняется. Удаление файлов — забота
+    счетчиков ссылок (recipes.MediaFile), а не полей модели.
+    """
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.hashed_name(name, content)
+        try:
+            return super().save(name, content, max_length=max_length)
+        except FileExistsError:
+            # Тот же файл уже сохранен, в том числе параллельной загрузкой.
+            return name
+
+    def get_available_name(self, name, max_length=None):
+        """
+        Суффикс к занятому имени сломал бы адресацию по содержимому:
+        занятое имя значит, что такой файл уже есть. FileSystemStorage
+        зовет этот метод и при гонке на создании файла (O_EXCL).
+        """
+
+        if self.exists(name):
+            raise FileExistsError(name)
+        return name
+
+    @staticmethod
+    def hashed_name(name, content):
+        digest = hashlib.sha256()
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        for chunk in content.chunks(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        digest = digest.hexdigest()
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        return '/'.join(
+            part for part in (
+                directory, digest[:2], digest[2:4], digest + extension
+            ) if part
+        )
+
+
+content_storage = ContentAddressedStorage()
@@ -0,0 +1,300 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock, skipUnless
+
+import psycopg2
+from api.catalog import ingredient_catalog
+from api.ingredient_index import ingredient_index
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import connection, connections, transaction
+from django.test import SimpleTestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from recipes.models import Recipe
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from users.models import User
+
+from .db_pool.base import (ConnectionPool, DatabaseWrapper, PoolTimeout,
+                           get_pool)
+from .routers import (PIN_COOKIE, PRIMARY, ReplicaRouter, read_from_replica,
+                      replica_aliases, replica_lag)
+from .storage import ContentAddressedStorage
+
+REPLICAS = replica_aliases()
+
+
+@skipUnless(REPLICAS, 'Нужна реплика: задайте DB_REPLICA_HOSTS')
+class ReplicaRoutingTest(TransactionTestCase):
+    """
+    Маршрутизация чтения между primary и репликой. В тестах реплика —
+    зеркало тестовой базы (TEST MIRROR), поэтому данные общие, а
+    запросы считаются по соединениям.
+    """
+
+    databases = {PRIMARY, *REPLICAS}
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='reader', email='reader@example.com',
+            first_name='Читатель', last_name='Читатель'
+        )
+        self.recipe = Recipe.objects.create(
+            name='Рецепт', text='Описание', cooking_time=5,
+            author=self.user, image='recipes/images/recipe.png'
+        )
+        self.token = Token.objects.create(user=self.user)
+        replica_lag.reset()
+        self.addCleanup(replica_lag.reset)
+
+    def get(self, client, url):
+        """Ответ и число запросов к primary и к репликам."""
+
+        with CaptureQueriesContext(connections[PRIMARY]) as primary:
+            with CaptureQueriesContext(
+                connections[REPLICAS[0]]
+            ) as replica:
+                response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(primary), len(replica)
+
+    def token_client(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        return client
+
+    def test_safe_request_reads_from_replica(self):
+        primary, replica = self.get(APIClient(), '/api/users/')
+        self.assertEqual(primary, 0)
+        self.assertGreater(replica, 0)
+
+    def test_cached_and_conditional_reads_use_primary(self):
+        # Кэш по поколениям и ETag нельзя заполнять с отставшей реплики.
+        cache.clear()
+        ingredient_index.invalidate()
+        ingredient_catalog.invalidate()
+        for url in (
+            '/api/recipes/', f'/api/recipes/{self.recipe.pk}/',
+            '/api/tags/', '/api/ingredients/?name=с',
+        ):
+            with self.subTest(url=url):
+                primary, replica = self.get(APIClient(), url)
+                self.assertGreater(primary, 0)
+                self.assertEqual(replica, 0)
+        with CaptureQueriesContext(connections[REPLICAS[0]]) as replica:
+            token = read_from_replica.set(True)
+            try:
+                ingredient_catalog.missing([1])
+            finally:
+                read_from_replica.reset(token)
+        self.assertEqual(len(replica), 0)
+
+    def test_write_pins_token_to_primary(self):
+        client = self.token_client()
+        response = client.post(f'/api/recipes/{self.recipe.pk}/favorite/')
+        self.assertEqual(response.status_code, 201)
+        # Закрепление по токену, без cookie.
+        primary, replica = self.get(self.token_client(), '/api/users/')
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+
+    def test_cookie_pins_to_primary(self):
+        client = APIClient()
+        client.cookies[PIN_COOKIE] = str(time.time() + 5)
+        primary, replica = self.get(client, '/api/users/')
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+
+    def test_expired_pin_reads_from_replica(self):
+        client = APIClient()
+        client.cookies[PIN_COOKIE] = str(time.time() - 1)
+        self.assertEqual(self.get(client, '/api/users/')[0], 0)
+
+    def test_lagging_replica_falls_back_to_primary(self):
+        for alias in REPLICAS:
+            replica_lag._checked[alias] = time.monotonic(), None
+        primary, replica = self.get(APIClient(), '/api/users/')
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+
+    def test_transaction_reads_from_primary(self):
+        token = read_from_replica.set(True)
+        self.addCleanup(read_from_replica.reset, token)
+        router = ReplicaRouter()
+        self.assertIn(router.db_for_read(Recipe), REPLICAS)
+        with transaction.atomic():
+            self.assertEqual(router.db_for_read(Recipe), PRIMARY)
+
+
+class FakeConnection:
+    """Соединение psycopg2 в той мере, в какой его касается пул."""
+
+    def __init__(self, broken=False):
+        self.closed = 0
+        self.broken = broken
+        self.status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def get_transaction_status(self):
+        return self.status
+
+    def rollback(self):
+        self.status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+    def cursor(self):
+        connection = self
+
+        class Cursor:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc_info):
+                return False
+
+            def execute(self, sql):
+                if connection.broken:
+                    raise psycopg2.OperationalError('server closed')
+
+        return Cursor()
+
+
+class ConnectionPoolTest(SimpleTestCase):
+    """Выдача, возврат, предел размера и проверка соединений пула."""
+
+    def setUp(self):
+        self.pool = ConnectionPool(max_size=2, timeout=0.05, check_after=30)
+        self.created = []
+
+    def connect(self):
+        connection = FakeConnection()
+        self.created.append(connection)
+        return connection
+
+    def test_released_connection_is_reused(self):
+        first = self.pool.acquire(self.connect)
+        self.pool.release(first)
+        self.assertIs(self.pool.acquire(self.connect), first)
+        self.assertEqual(len(self.created), 1)
+
+    def test_open_transaction_is_rolled_back_on_release(self):
+        connection = self.pool.acquire(self.connect)
+        connection.status = psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+        self.pool.release(connection)
+        self.assertEqual(
+            connection.get_transaction_status(),
+            psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        )
+        self.assertEqual(self.pool.stats()['idle'], 1)
+
+    def test_max_size_times_out(self):
+        self.pool.acquire(self.connect)
+        self.pool.acquire(self.connect)
+        with self.assertRaises(PoolTimeout):
+            self.pool.acquire(self.connect)
+        stats = self.pool.stats()
+        self.assertEqual((stats['in_use'], stats['timeouts']), (2, 1))
+
+    def test_stale_connection_is_checked(self):
+        self.pool.check_after = 0
+        connection = self.pool.acquire(self.connect)
+        self.pool.release(connection)
+        connection.broken = True
+        fresh = self.pool.acquire(self.connect)
+        self.assertIsNot(fresh, connection)
+        self.assertTrue(connection.closed)
+        self.assertEqual(self.pool.stats()['discarded'], 1)
+
+    def test_closed_connection_is_not_returned(self):
+        connection = self.pool.acquire(self.connect)
+        connection.close()
+        self.pool.release(connection)
+        self.assertEqual(self.pool.stats()['idle'], 0)
+
+    def test_release_without_reuse_and_drain_close(self):
+        kept = self.pool.acquire(self.connect)
+        dropped = self.pool.acquire(self.connect)
+        self.pool.release(kept)
+        self.pool.release(dropped, reuse=False)
+        self.assertTrue(dropped.closed)
+        self.pool.drain()
+        self.assertTrue(kept.closed)
+        stats = self.pool.stats()
+        self.assertEqual((stats['in_use'], stats['idle']), (0, 0))
+
+    def test_pools_are_keyed_by_connection_parameters(self):
+        params = {'database': 'foodgram', 'host': 'db', 'user': 'django'}
+        self.assertIs(
+            get_pool('pool_test', {}, params),
+            get_pool('pool_test', {}, dict(params))
+        )
+        self.assertIsNot(
+            get_pool('pool_test', {}, params),
+            get_pool('pool_test', {}, {**params, 'database': 'test_foodgram'})
+        )
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Нужен PostgreSQL')
+class PooledDatabaseWrapperTest(SimpleTestCase):
+    """Конец запроса возвращает соединение в пул, close() — закрывает."""
+
+    databases = {PRIMARY}
+
+    def setUp(self):
+        self.wrapper = DatabaseWrapper(
+            {**connections[PRIMARY].settings_dict, 'CONN_MAX_AGE': 0},
+            alias='pool_test'
+        )
+        self.addCleanup(self.wrapper.close)
+
+    def query(self):
+        with self.wrapper.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        return self.wrapper.connection
+
+    def test_request_end_returns_connection_to_pool(self):
+        raw = self.query()
+        self.wrapper.close_if_unusable_or_obsolete()
+        self.assertEqual(self.wrapper.pool.stats()['idle'], 1)
+        self.assertIs(self.query(), raw)
+
+    def test_close_closes_connection_and_idle_ones(self):
+        raw = self.query()
+        self.wrapper.close()
+        self.assertTrue(raw.closed)
+        self.assertEqual(self.wrapper.pool.stats()['idle'], 0)
+
+
+class ContentAddressedStorageTest(SimpleTestCase):
+    """Имя файла — хэш содержимого, в том числе при гонке загрузок."""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.storage = ContentAddressedStorage(location=self.root)
+
+    def test_same_content_same_name(self):
+        first = self.storage.save('recipes/a.PNG', ContentFile(b'image'))
+        second = self.storage.save('recipes/b.png', ContentFile(b'image'))
+        digest = hashlib.sha256(b'image').hexdigest()
+        self.assertEqual(first, f'recipes/{digest[:2]}/{digest[2:4]}/'
+                                f'{digest}.png')
+        self.assertEqual(second, first)
+
+    def test_concurrent_upload_keeps_hashed_name(self):
+        name = self.storage.save('recipes/a.png', ContentFile(b'image'))
+        # Параллельная загрузка создала файл между проверкой и записью.
+        with mock.patch.object(
+            self.storage, 'exists', side_effect=[False, True]
+        ):
+            self.assertEqual(
+                self.storage.save('recipes/a.png', ContentFile(b'image')),
+                name
+            )
+        self.assertEqual(os.listdir(os.path.dirname(
+            self.storage.path(name)
+        )), [os.path.basename(name)])
@@ -4,11 +4,14 @@ from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import include, path
 
+from .metrics import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('api.urls', namespace='api')),
     path('s/<str:short_link>/', redirect_short_link,
          name='redirect_short_link'),
+    path('metrics', metrics_view, name='metrics'),
 ]
 
 if settings.DEBUG:
@@ -1,6 +1,12 @@
+from collections import Counter
+
 from django.contrib import admin
+from django.db import transaction
+from django.db.models import F
 from recipes.models import (FavoriteRecipe, Ingredient, Recipe,
                             RecipeIngredient, ShoppingCart, ShortLink, Tag)
+from recipes.utils import shift_shopping_lists
+from users.models import User
 
 
 @admin.register(Tag)
@@ -51,13 +57,43 @@ class RecipeAdmin(admin.ModelAdmin):
     readonly_fields = ('author', 'favorites_count')
     inlines = (IngredientsInline,)
 
+    @transaction.atomic
     def save_model(self, request, obj, form, change):
+        previous_author_id = obj.author_id if change else None
         obj.author = request.user
         obj.save()
-
-    @admin.display(description='Количество избранных рецептов')
-    def favorites_count(self, obj):
-        return obj.favorite.count()
+        obj.update_search_vector()
+        if previous_author_id != obj.author_id:
+            User.objects.filter(pk=obj.author_id).update(
+                recipes_count=F('recipes_count') + 1
+            )
+            User.objects.filter(pk=previous_author_id).update(
+                recipes_count=F('recipes_count') - 1
+            )
+
+    @transaction.atomic
+    def save_related(self, request, form, formsets, change):
+        """Ингредиенты из инлайна пересчитываются в списках покупок."""
+
+        if change:
+            shift_shopping_lists(-1, (form.instance.pk,))
+        super().save_related(request, form, formsets, change)
+        if change:
+            shift_shopping_lists(1, (form.instance.pk,))
+
+    @transaction.atomic
+    def delete_model(self, request, obj):
+        self.delete_queryset(request, Recipe.objects.filter(pk=obj.pk))
+
+    @transaction.atomic
+    def delete_queryset(self, request, queryset):
+        authors = Counter(queryset.values_list('author_id', flat=True))
+        shift_shopping_lists(-1, queryset.values_list('pk', flat=True))
+        super().delete_queryset(request, queryset)
+        for author_id, deleted in authors.items():
+            User.objects.filter(pk=author_id).update(
+                recipes_count=F('recipes_count') - deleted
+            )
 
 
 @admin.register(ShortLink)
@@ -5,3 +5,16 @@ MAX_LEN_RECIPE_NAME = 256
 MAX_LEN_MEASUREMENT_UNIT = 64
 MIN_COOKING_TIME = 1
 MIN_INGREDIENT_AMOUNT = 1
+RECIPE_COUNTER_FIELDS = ('favorites_count', 'in_carts_count')
+MAX_RECIPES_BATCH = 100
+SEARCH_CONFIG = 'russian'
+SHORT_LINK_ALPHABET = (
+    '0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
+)
+# Коды короче 4 символов остались от случайной генерации.
+SHORT_LINK_MIN_LENGTH = 4
+SHORT_LINK_MAX_LENGTH = 12
+# Множитель взаимно прост с 62, поэтому каждый раунд обратим.
+SHORT_LINK_MULTIPLIER = 0x9E3779B97F4A7C15
+SHORT_LINK_INCREMENT = 0x632BE59BD9B4E019
+SHORT_LINK_ROUNDS = 3
@@ -0,0 +1,92 @@
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+from recipes.models import RecipeIngredient, ShoppingListItem
+from recipes.utils import rebuild_shopping_lists
+
+MISSING = object()
+
+
+def live_totals():
+    """Фактические суммы ингредиентов по корзинам, упорядоченные по ключу."""
+
+    return RecipeIngredient.objects.filter(
+        recipe__shopping_cart__isnull=False
+    ).values_list(
+        'recipe__shopping_cart__user__id', 'ingredient_id'
+    ).annotate(total=Sum('amount')).order_by(
+        'recipe__shopping_cart__user__id', 'ingredient_id'
+    ).iterator()
+
+
+def stored_totals():
+    return ShoppingListItem.objects.values_list(
+        'user_id', 'ingredient_id', 'amount'
+    ).order_by('user_id', 'ingredient_id').iterator()
+
+
+def merge(live, stored):
+    """
+    Слияние двух упорядоченных потоков (user, ingredient, amount):
+    отдает ключ и обе суммы, отсутствующую — как MISSING.
+    """
+
+    live_row, stored_row = next(live, None), next(stored, None)
+    while live_row is not None or stored_row is not None:
+        if stored_row is None or (
+            live_row is not None and live_row[:2] < stored_row[:2]
+        ):
+            yield live_row[:2], live_row[2], MISSING
+            live_row = next(live, None)
+        elif live_row is None or stored_row[:2] < live_row[:2]:
+            yield stored_row[:2], MISSING, stored_row[2]
+            stored_row = next(stored, None)
+        else:
+            yield live_row[:2], live_row[2], stored_row[2]
+            live_row, stored_row = next(live, None), next(stored, None)
+
+
+class Command(BaseCommand):
+
+    help = ('Сверяет материализованные списки покупок с суммами '
+            'ингредиентов в корзинах')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fix',
+            action='store_true',
+            help='Пересобрать списки пользователей с расхождениями.',
+        )
+
+    def handle(self, *args, **options):
+        missing = extra = different = 0
+        users = set()
+        with transaction.atomic():
+            for (user_id, _), live, stored in merge(
+                live_totals(), stored_totals()
+            ):
+                if stored is MISSING:
+                    missing += 1
+                elif live is MISSING:
+                    extra += 1
+                elif live != stored:
+                    different += 1
+                else:
+                    continue
+                users.add(user_id)
+            self.stdout.write(
+                f'Нет в таблице: {missing}, лишних: {extra}, '
+                f'с другой суммой: {different}, '
+                f'пользователей с расхождениями: {len(users)}'
+            )
+            if not users:
+                self.stdout.write(self.style.SUCCESS('Расхождений нет'))
+            elif options['fix']:
+                rebuild_shopping_lists(users)
+                self.stdout.write(self.style.SUCCESS(
+                    f'Списки покупок пересобраны: {len(users)}'
+                ))
+            else:
+                self.stdout.write(self.style.WARNING(
+                    'Запустите с --fix, чтобы пересобрать списки'
+                ))
@@ -0,0 +1,97 @@
+import json
+import sys
+from collections import defaultdict
+
+from django.core.management import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from recipes.models import Recipe, RecipeIngredient
+from recipes.utils import batched
+
+CHUNK_SIZE = 500
+
+
+def grouped(rows):
+    """Группирует строки (recipe_id, ...) по рецепту."""
+
+    groups = defaultdict(list)
+    for recipe_id, *values in rows:
+        groups[recipe_id].append(values)
+    return groups
+
+
+class Command(BaseCommand):
+
+    help = ('Выгружает рецепты с тегами, ингредиентами и авторами '
+            'в формате JSON Lines')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output',
+            default='-',
+            help='Файл выгрузки, по умолчанию stdout.',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=CHUNK_SIZE,
+            help='Сколько рецептов читать из курсора за раз.',
+        )
+
+    def handle(self, *args, **options):
+        output = (
+            sys.stdout if options['output'] == '-'
+            else open(options['output'], 'w', encoding='utf-8')
+        )
+        exported = 0
+        try:
+            recipes = Recipe.objects.order_by('id').values_list(
+                'id', 'name', 'text', 'cooking_time', 'pub_date', 'image',
+                'author__username'
+            ).iterator(chunk_size=options['chunk_size'])
+            for chunk in batched(recipes, options['chunk_size']):
+                for line in self.serialize(chunk):
+                    output.write(line + '\n')
+                exported += len(chunk)
+        finally:
+            if output is not sys.stdout:
+                output.close()
+        self.stderr.write(self.style.SUCCESS(
+            f'Выгружено рецептов: {exported}'
+        ))
+
+    @staticmethod
+    def serialize(chunk):
+        """Строки JSON для пачки рецептов: два запроса на пачку."""
+
+        ids = [row[0] for row in chunk]
+        ingredients = grouped(RecipeIngredient.objects.filter(
+            recipe_id__in=ids
+        ).values_list(
+            'recipe_id', 'ingredient__name', 'ingredient__measurement_unit',
+            'amount'
+        ).order_by('recipe_id', 'ingredient__name'))
+        tags = grouped(Recipe.tags.through.objects.filter(
+            recipe_id__in=ids
+        ).values_list('recipe_id', 'tag__slug', 'tag__name').order_by(
+            'recipe_id', 'tag__slug'
+        ))
+        for recipe_id, name, text, cooking_time, pub_date, image, author in (
+            chunk
+        ):
+            yield json.dumps({
+                'name': name,
+                'text': text,
+                'cooking_time': cooking_time,
+                'pub_date': pub_date,
+                'image': image,
+                'author': author,
+                'tags': [
+                    {'slug': slug, 'name': tag_name}
+                    for slug, tag_name in tags[recipe_id]
+                ],
+                'ingredients': [
+                    {'name': ingredient, 'measurement_unit': unit,
+                     'amount': amount}
+                    for ingredient, unit, amount in ingredients[recipe_id]
+                ],
+            }, ensure_ascii=False, cls=DjangoJSONEncoder)
@@ -0,0 +1,269 @@
+import json
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from api.cache import INGREDIENTS_SCOPE, RECIPES_SCOPE, TAGS_SCOPE
+from api.signals import invalidate_after_bulk
+from django.core.files import File
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils.dateparse import parse_datetime
+from recipes.models import (Ingredient, Recipe, RecipeIngredient, Tag,
+                            recipe_search_vector)
+from recipes.utils import batched, shift_media_references
+from users.models import User
+
+BATCH_SIZE = 500
+IMAGE_WORKERS = 8
+
+
+class Command(BaseCommand):
+
+    help = ('Загружает рецепты из JSON Lines, выгруженного export_recipes. '
+            'Рецепты автора с уже существующим названием пропускаются')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            help='Файл выгрузки или - для stdin.',
+        )
+        parser.add_argument(
+            '--media-root',
+            help=('Каталог media исходного окружения: изображения будут '
+                  'скопированы в хранилище. Без него пути сохраняются '
+                  'как есть.'),
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+            help='Сколько рецептов сохранять за одну транзакцию.',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=IMAGE_WORKERS,
+            help='Потоков для копирования изображений.',
+        )
+
+    def handle(self, *args, **options):
+        if options['path'] == '-':
+            source = sys.stdin
+        elif Path(options['path']).exists():
+            source = open(options['path'], encoding='utf-8')
+        else:
+            raise CommandError(f'Файл {options["path"]} не найден')
+        self.media_root = (
+            Path(options['media_root']) if options['media_root'] else None
+        )
+        stats = Counter()
+        started = time.monotonic()
+        try:
+            with ThreadPoolExecutor(options['workers']) as executor:
+                records = (json.loads(line) for line in source if line.strip())
+                for batch in batched(records, options['batch_size']):
+                    with transaction.atomic():
+                        self.import_batch(batch, executor, stats)
+        finally:
+            if source is not sys.stdin:
+                source.close()
+            if stats['imported']:
+                # Пачки пишутся bulk-запросами, минуя сигналы моделей.
+                invalidate_after_bulk(
+                    RECIPES_SCOPE, TAGS_SCOPE, INGREDIENTS_SCOPE
+                )
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f'Пропущено: существующих {stats["existing"]}, '
+            f'без автора {stats["no_author"]}, '
+            f'без изображения {stats["no_image"]}'
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Загружено рецептов: {stats["imported"]} за {elapsed:.2f} с'
+        ))
+
+    def import_batch(self, records, executor, stats):
+        authors = dict(User.objects.filter(
+            username__in={record['author'] for record in records}
+        ).values_list('username', 'id'))
+        existing = set(Recipe.objects.filter(
+            author_id__in=authors.values(),
+            name__in={record['name'] for record in records}
+        ).values_list('author_id', 'name'))
+        fresh = []
+        for record in records:
+            author_id = authors.get(record['author'])
+            if author_id is None:
+                stats['no_author'] += 1
+            elif (author_id, record['name']) in existing:
+                stats['existing'] += 1
+            else:
+                existing.add((author_id, record['name']))
+                fresh.append((author_id, record))
+        images = executor.map(
+            self.copy_image, [record['image'] for _, record in fresh]
+        )
+        pairs = []
+        for (author_id, record), image in zip(fresh, images):
+            if image is None:
+                stats['no_image'] += 1
+                continue
+            pairs.append((Recipe(
+                author_id=author_id,
+                name=record['name'],
+                text=record['text'],
+                cooking_time=record['cooking_time'],
+                image=image,
+            ), record))
+        if not pairs:
+            return
+        self.save_recipes(pairs)
+        tags = self.get_tags(
+            [tag for _, record in pairs for tag in record['tags']]
+        )
+        ingredients = self.get_catalog(
+            Ingredient, ('name', 'measurement_unit'),
+            ('name', 'measurement_unit'),
+            (ingredient for _, record in pairs
+             for ingredient in record['ingredients'])
+        )
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(
+                recipe_id=recipe.pk,
+                ingredient_id=ingredients[
+                    ingredient['name'], ingredient['measurement_unit']
+                ],
+                amount=ingredient['amount'],
+            )
+            for recipe, record in pairs
+            for ingredient in record['ingredients']
+        )
+        # Разные slug выгрузки могут указывать на один тег базы.
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+            for recipe_id, tag_id in {
+                (recipe.pk, tags[tag['slug']])
+                for recipe, record in pairs for tag in record['tags']
+            }
+        )
+        Recipe.objects.filter(
+            pk__in=[recipe.pk for recipe, _ in pairs]
+        ).update(search_vector=recipe_search_vector())
+        shift_media_references(
+            added=[recipe.image.name for recipe, _ in pairs]
+        )
+        for author_id, imported in Counter(
+            recipe.author_id for recipe, _ in pairs
+        ).items():
+            User.objects.filter(pk=author_id).update(
+                recipes_count=F('recipes_count') + imported
+            )
+        stats['imported'] += len(pairs)
+
+    @staticmethod
+    def save_recipes(pairs):
+        """
+        bulk_create с возвратом первичных ключей там, где база это умеет;
+        дата публикации из выгрузки проставляется вторым запросом,
+        так как auto_now_add перезаписывает ее при вставке.
+        """
+
+        recipes = [recipe for recipe, _ in pairs]
+        if connection.features.can_return_rows_from_bulk_insert:
+            Recipe.objects.bulk_create(recipes)
+        else:
+            for recipe in recipes:
+                recipe.save()
+        for recipe, record in pairs:
+            recipe.pub_date = (
+                parse_datetime(record['pub_date']) or recipe.pub_date
+            )
+        Recipe.objects.bulk_update(recipes, ('pub_date',))
+
+    def get_tags(self, rows, create=True):
+        """
+        Словарь slug из выгрузки -> id тега. Тег ищется по slug, затем
+        по названию: в этой базе у него может быть другой slug.
+        Недостающие теги создаются.
+        """
+
+        rows = {row['slug']: row for row in rows}
+        by_slug = dict(
+            Tag.objects.filter(slug__in=rows).values_list('slug', 'id')
+        )
+        by_name = dict(Tag.objects.filter(
+            name__in={row['name'] for row in rows.values()}
+        ).values_list('name', 'id'))
+        found, missing = {}, []
+        for slug, row in rows.items():
+            slug_id, name_id = by_slug.get(slug), by_name.get(row['name'])
+            if slug_id and name_id and slug_id != name_id:
+                raise CommandError(
+                    f'Тег «{row["name"]}» ({slug}): slug и название '
+                    'принадлежат разным тегам этой базы'
+                )
+            if slug_id or name_id:
+                found[slug] = slug_id or name_id
+            else:
+                missing.append(row)
+        if missing and not create:
+            raise CommandError(
+                'Не удалось создать теги: '
+                + ', '.join(row['slug'] for row in missing)
+            )
+        if missing:
+            Tag.objects.bulk_create(
+                (Tag(slug=row['slug'], name=row['name']) for row in missing),
+                ignore_conflicts=True
+            )
+            return self.get_tags(rows.values(), create=False)
+        return found
+
+    @staticmethod
+    def get_catalog(model, key_fields, fields, rows):
+        """
+        Словарь ключ -> id справочника; недостающие записи
+        создаются из полей fields.
+        """
+
+        rows = {tuple(row[field] for field in key_fields): row for row in rows}
+        lookup = {f'{field}__in': {key[number] for key in rows}
+                  for number, field in enumerate(key_fields)}
+        found = {
+            tuple(values[1:]): values[0]
+            for values in model.objects.filter(**lookup).values_list(
+                'id', *key_fields
+            )
+        }
+        missing = [row for key, row in rows.items() if key not in found]
+        if missing:
+            model.objects.bulk_create(
+                (model(**{field: row[field] for field in fields})
+                 for row in missing),
+                ignore_conflicts=True
+            )
+            found.update(
+                (tuple(values[1:]), values[0])
+                for values in model.objects.filter(**lookup).values_list(
+                    'id', *key_fields
+                )
+            )
+        return found
+
+    def copy_image(self, name):
+        """
+        Копирует файл из --media-root в хранилище рецептов,
+        возвращает новое имя (одинаковые картинки станут одним файлом).
+        """
+
+        if self.media_root is None:
+            return name
+        path = self.media_root / name
+        if not path.is_file():
+            return None
+        with open(path, 'rb') as image:
+            return Recipe.image.field.storage.save(name, File(image))
@@ -1,21 +1,151 @@
-from csv import DictReader
+import csv
+import json
+import time
+from pathlib import Path
 
+from api.cache import INGREDIENTS_SCOPE, RECIPES_SCOPE
+from api.exporters import Echo
+from api.signals import invalidate_after_bulk
 from django.conf import settings
-from django.core.management import BaseCommand
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, transaction
 from recipes.models import Ingredient
+from recipes.utils import batched
 
 DATA_DIR = settings.BASE_DIR / 'data'
+BATCH_SIZE = 5000
+
+
+class CSVStream:
+    """Файлоподобный объект для COPY: строки CSV формируются по мере чтения."""
+
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.writer = csv.writer(Echo())
+        self.buffer = ''
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            row = next(self.rows, None)
+            if row is None:
+                break
+            self.buffer += self.writer.writerow(row)
+        if size < 0:
+            size = len(self.buffer)
+        chunk, self.buffer = self.buffer[:size], self.buffer[size:]
+        return chunk
+
+
+def read_rows(path):
+    """Пары (name, measurement_unit) из csv или json без крайних пробелов."""
+
+    with open(path, encoding='utf-8') as file:
+        if path.suffix == '.json':
+            rows = json.load(file)
+        elif path.suffix == '.csv':
+            rows = csv.DictReader(file)
+        else:
+            raise CommandError('Поддерживаются только файлы .csv и .json')
+        for row in rows:
+            name = row['name'].strip()
+            if name:
+                yield name, row['measurement_unit'].strip()
 
 
 class Command(BaseCommand):
 
-    help = "Загружает ингредиенты в БД из csv"
+    help = ('Загружает ингредиенты в БД из csv или json. Повторный запуск '
+            'добавляет только новые пары (name, measurement_unit)')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            nargs='?',
+            default=str(DATA_DIR / 'ingredients.csv'),
+            help='Путь к ingredients.csv или ingredients.json.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+            help='Размер пачки bulk_create для баз без COPY.',
+        )
 
     def handle(self, *args, **options):
-        with open(
-            DATA_DIR / 'ingredients.csv', encoding='utf-8'
-        ) as ingredients:
-            if Ingredient.objects.count() < 1:
-                for row in DictReader(ingredients):
-                    instance = Ingredient(**row)
-                    instance.save()
+        path = Path(options['path'])
+        if not path.exists():
+            raise CommandError(f'Файл {path} не найден')
+        started = time.monotonic()
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                total, distinct, inserted = self.copy_rows(path)
+            else:
+                total, distinct, inserted = self.bulk_create_rows(
+                    path, options['batch_size']
+                )
+            if inserted:
+                invalidate_after_bulk(INGREDIENTS_SCOPE, RECIPES_SCOPE)
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f'Строк в файле: {total}, повторов в файле: {total - distinct}'
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Добавлено: {inserted}, без изменений: {distinct - inserted} '
+            f'за {elapsed:.2f} с ({total / max(elapsed, 1e-6):.0f} строк/с)'
+        ))
+
+    @staticmethod
+    def copy_rows(path):
+        """
+        COPY во временную таблицу и перенос новых пар одним
+        INSERT ... ON CONFLICT DO NOTHING.
+        """
+
+        table = connection.ops.quote_name(Ingredient._meta.db_table)
+        total = 0
+
+        def counted(rows):
+            nonlocal total
+            for row in rows:
+                total += 1
+                yield row
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMPORARY TABLE ingredient_stage '
+                '(name text, measurement_unit text) ON COMMIT DROP'
+            )
+            cursor.copy_expert(
+                'COPY ingredient_stage (name, measurement_unit) '
+                'FROM STDIN WITH (FORMAT csv)',
+                CSVStream(counted(read_rows(path)))
+            )
+            cursor.execute(
+                'SELECT COUNT(*) FROM (SELECT DISTINCT name, '
+                'measurement_unit FROM ingredient_stage) AS stage'
+            )
+            distinct, = cursor.fetchone()
+            cursor.execute(
+                f'INSERT INTO {table} (name, measurement_unit) '
+                'SELECT DISTINCT name, measurement_unit '
+                'FROM ingredient_stage '
+                'ON CONFLICT (name, measurement_unit) DO NOTHING'
+            )
+            return total, distinct, cursor.rowcount
+
+    @staticmethod
+    def bulk_create_rows(path, batch_size):
+        """Запасной путь: пачки bulk_create с пропуском существующих пар."""
+
+        before = Ingredient.objects.count()
+        total, seen = 0, set()
+        for batch in batched(read_rows(path), batch_size):
+            total += len(batch)
+            new = [row for row in dict.fromkeys(batch) if row not in seen]
+            seen.update(new)
+            Ingredient.objects.bulk_create(
+                (Ingredient(name=name, measurement_unit=measurement_unit)
+                 for name, measurement_unit in new),
+                ignore_conflicts=True
+            )
+        return total, len(seen), Ingredient.objects.count() - before
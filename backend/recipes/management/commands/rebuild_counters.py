@@ -0,0 +1,62 @@
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from recipes.models import FavoriteRecipe, Recipe, ShoppingCart
+from users.models import Follower, User
+
+COUNTERS = (
+    (Recipe, 'favorites_count', FavoriteRecipe, 'recipe'),
+    (Recipe, 'in_carts_count', ShoppingCart, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', Follower, 'author'),
+)
+
+
+def count_subquery(model, field):
+    """Коррелированный подзапрос с фактическим количеством связанных строк."""
+
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')}).order_by().values(
+            field
+        ).annotate(total=Count('pk')).values('total')
+    ), 0)
+
+
+class Command(BaseCommand):
+
+    help = ('Пересчитывает денормализованные счетчики рецептов '
+            'и пользователей и сообщает о расхождениях')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только проверить расхождения, ничего не изменяя.',
+        )
+
+    def handle(self, *args, **options):
+        drifted_total = 0
+        with transaction.atomic():
+            for model, counter, related_model, field in COUNTERS:
+                actual = count_subquery(related_model, field)
+                drifted = model.objects.annotate(actual=actual).exclude(
+                    **{counter: F('actual')}
+                ).count()
+                drifted_total += drifted
+                self.stdout.write(
+                    f'{model._meta.model_name}.{counter}: '
+                    f'расхождений {drifted}'
+                )
+                if drifted and not options['check']:
+                    model.objects.update(**{counter: actual})
+        if options['check'] and drifted_total:
+            self.stdout.write(self.style.WARNING(
+                f'Найдено расхождений: {drifted_total}'
+            ))
+        elif options['check']:
+            self.stdout.write(self.style.SUCCESS('Расхождений нет'))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f'Счетчики пересчитаны, исправлено: {drifted_total}'
+            ))
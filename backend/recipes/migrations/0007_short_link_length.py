@@ -0,0 +1,28 @@
+# Generated by Django 3.2 on 2026-10-17 06:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_shopping_list'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='shortlink',
+            options={'verbose_name': 'Короткая ссылка', 'verbose_name_plural': 'Короткиу ссылки'},
+        ),
+        migrations.AlterField(
+            model_name='shortlink',
+            name='recipe',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='short_link', to='recipes.recipe', verbose_name='Рецепт'),
+        ),
+        migrations.AlterField(
+            model_name='shortlink',
+            name='short_link',
+            field=models.CharField(blank=True, max_length=12, null=True, unique=True, verbose_name='Короткая ссылка'),
+        ),
+    ]
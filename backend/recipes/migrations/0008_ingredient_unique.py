@@ -0,0 +1,66 @@
+# Generated by Django 3.2 on 2026-10-17 06:10
+
+from django.db import migrations, models, transaction
+from django.db.models import Count, Min
+
+
+def merge_duplicates(apps, schema_editor):
+    """
+    Сливает повторы (name, measurement_unit) в ингредиент с меньшим id,
+    складывая количества там, где у владельца уже есть оставшийся.
+    """
+
+    with transaction.atomic(using=schema_editor.connection.alias):
+        merge_groups(apps)
+
+
+def merge_groups(apps):
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    related = (
+        (apps.get_model('recipes', 'RecipeIngredient'), 'recipe_id'),
+        (apps.get_model('recipes', 'ShoppingListItem'), 'user_id'),
+    )
+    duplicates = Ingredient.objects.values(
+        'name', 'measurement_unit'
+    ).annotate(keep=Min('id'), total=Count('id')).filter(total__gt=1)
+    for group in duplicates:
+        keep = group['keep']
+        extra = list(Ingredient.objects.filter(
+            name=group['name'], measurement_unit=group['measurement_unit']
+        ).exclude(id=keep).values_list('id', flat=True))
+        for model, owner in related:
+            kept = {
+                getattr(row, owner): row
+                for row in model.objects.filter(ingredient_id=keep)
+            }
+            for row in model.objects.filter(ingredient_id__in=extra):
+                target = kept.get(getattr(row, owner))
+                if target is None:
+                    row.ingredient_id = keep
+                    row.save(update_fields=('ingredient',))
+                    kept[getattr(row, owner)] = row
+                else:
+                    target.amount += row.amount
+                    target.save(update_fields=('amount',))
+                    row.delete()
+        Ingredient.objects.filter(id__in=extra).delete()
+
+
+class Migration(migrations.Migration):
+
+    # Слияние коммитится отдельно от ALTER TABLE: в одной транзакции
+    # PostgreSQL отказывает ALTER TABLE при отложенных событиях триггеров
+    # внешних ключей, оставшихся от удалений.
+    atomic = False
+
+    dependencies = [
+        ('recipes', '0007_short_link_length'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique_ingredient_name_measurement_unit'),
+        ),
+    ]
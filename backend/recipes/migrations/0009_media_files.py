@@ -0,0 +1,52 @@
+# Generated by Django 3.2 on 2026-10-17 06:19
+
+from django.db import migrations, models
+from django.db.models import Count
+import foodgram_backend.storage
+
+
+def count_references(apps, schema_editor):
+    MediaFile = apps.get_model('recipes', 'MediaFile')
+    Recipe = apps.get_model('recipes', 'Recipe')
+    User = apps.get_model('users', 'User')
+    counts = {}
+    for model, field in ((Recipe, 'image'), (User, 'avatar')):
+        names = model.objects.exclude(**{f'{field}__isnull': True}).exclude(
+            **{field: ''}
+        ).values_list(field).annotate(total=Count('pk')).order_by()
+        for name, total in names.iterator():
+            counts[name] = counts.get(name, 0) + total
+    MediaFile.objects.bulk_create(
+        (MediaFile(name=name, reference_count=total)
+         for name, total in counts.items()),
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_ingredient_unique'),
+        ('users', '0003_avatar_storage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True, verbose_name='Путь к файлу')),
+                ('reference_count', models.IntegerField(verbose_name='Количество ссылок')),
+            ],
+            options={
+                'verbose_name': 'Файл',
+                'verbose_name_plural': 'Файлы',
+            },
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(default=None, storage=foodgram_backend.storage.ContentAddressedStorage(), upload_to='recipes/images/'),
+        ),
+        migrations.RunPython(count_references, migrations.RunPython.noop),
+    ]
@@ -1,17 +1,30 @@
-import random
-import string
-
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from django.core.validators import MinValueValidator, RegexValidator
 from django.db import models
+from foodgram_backend.storage import content_storage
 
 from .constants import (MAX_LEN_INGREDIENT_NAME, MAX_LEN_MEASUREMENT_UNIT,
                         MAX_LEN_RECIPE_NAME, MAX_LEN_TAG_FIELDS,
-                        MIN_COOKING_TIME, MIN_INGREDIENT_AMOUNT, REGEX_TAG)
+                        MIN_COOKING_TIME, MIN_INGREDIENT_AMOUNT,
+                        RECIPE_COUNTER_FIELDS, REGEX_TAG, SEARCH_CONFIG,
+                        SHORT_LINK_ALPHABET, SHORT_LINK_INCREMENT,
+                        SHORT_LINK_MAX_LENGTH, SHORT_LINK_MIN_LENGTH,
+                        SHORT_LINK_MULTIPLIER, SHORT_LINK_ROUNDS)
 
 User = get_user_model()
 
 
+def recipe_search_vector():
+    """Выражение поискового вектора рецепта: название весомее описания."""
+
+    return (
+        SearchVector('name', weight='A', config=SEARCH_CONFIG)
+        + SearchVector('text', weight='B', config=SEARCH_CONFIG)
+    )
+
+
 class Tag(models.Model):
     """Модель тегов."""
 
@@ -50,6 +63,12 @@ class Ingredient(models.Model):
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
         ordering = ('name',)
+        constraints = (
+            models.UniqueConstraint(
+                fields=('name', 'measurement_unit'),
+                name='unique_ingredient_name_measurement_unit'
+            ),
+        )
 
 
 class Recipe(models.Model):
@@ -80,6 +99,7 @@ class Recipe(models.Model):
     )
     image = models.ImageField(
         upload_to='recipes/images/',
+        storage=content_storage,
         null=False,
         default=None,
         blank=False
@@ -88,14 +108,65 @@ class Recipe(models.Model):
         verbose_name='Дата публикации',
         auto_now_add=True,
     )
+    updated_at = models.DateTimeField(
+        verbose_name='Дата изменения',
+        auto_now=True,
+    )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='Количество добавлений в избранное',
+        default=0,
+        editable=False,
+    )
+    in_carts_count = models.PositiveIntegerField(
+        verbose_name='Количество добавлений в список покупок',
+        default=0,
+        editable=False,
+    )
+    search_vector = SearchVectorField(
+        verbose_name='Поисковый вектор',
+        null=True,
+        editable=False,
+    )
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        """
+        Счетчики меняются только атомарными F()-обновлениями,
+        поэтому обычное сохранение их не перезаписывает.
+        """
+
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in RECIPE_COUNTER_FIELDS
+                and field.name != 'search_vector'
+            ]
+        super().save(*args, **kwargs)
+
+    def update_search_vector(self):
+        """Пересчитывает поисковый вектор рецепта."""
+
+        Recipe.objects.filter(pk=self.pk).update(
+            search_vector=recipe_search_vector()
+        )
+
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ('-pub_date',)
+        indexes = (
+            GinIndex(
+                fields=('search_vector',), name='recipe_search_vector_idx'
+            ),
+            GinIndex(
+                fields=('name',),
+                name='recipe_name_trgm_idx',
+                opclasses=('gin_trgm_ops',)
+            ),
+        )
 
 
 class FavoriteRecipe(models.Model):
@@ -174,6 +245,46 @@ class ShoppingCart(models.Model):
         )
 
 
+class ShoppingListItem(models.Model):
+    """
+    Материализованный список покупок: сумма ингредиента
+    по всем рецептам в корзине пользователя.
+    """
+
+    user = models.ForeignKey(
+        User, verbose_name='Пользователь', on_delete=models.CASCADE
+    )
+    ingredient = models.ForeignKey(
+        Ingredient, verbose_name='Ингредиент', on_delete=models.CASCADE
+    )
+    amount = models.IntegerField('Количество')
+
+    class Meta:
+        verbose_name = 'Позиция списка покупок'
+        verbose_name_plural = 'Позиции списков покупок'
+        default_related_name = 'shopping_list'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'ingredient'),
+                name='unique_user_shopping_list_ingredient'
+            ),
+        )
+
+
+class MediaFile(models.Model):
+    """
+    Счетчик ссылок на файл хранилища: картинки рецептов и аватары
+    с одинаковым содержимым хранятся одним файлом.
+    """
+
+    name = models.CharField('Путь к файлу', max_length=255, unique=True)
+    reference_count = models.IntegerField('Количество ссылок')
+
+    class Meta:
+        verbose_name = 'Файл'
+        verbose_name_plural = 'Файлы'
+
+
 class ShortLink(models.Model):
     """Модель для хранения коротких ссылок на рецепты."""
 
@@ -182,7 +293,7 @@ class ShortLink(models.Model):
         related_name='short_link', verbose_name='Рецепт'
     )
     short_link = models.CharField(
-        max_length=3, unique=True,
+        max_length=SHORT_LINK_MAX_LENGTH, unique=True,
         blank=True, null=True, verbose_name='Короткая ссылка'
     )
 
@@ -191,17 +302,38 @@ class ShortLink(models.Model):
         verbose_name_plural = 'Короткиу ссылки'
 
     def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
         if not self.short_link:
             self.short_link = self.generate_short_link()
-        super().save(*args, **kwargs)
+            ShortLink.objects.filter(pk=self.pk).update(
+                short_link=self.short_link
+            )
 
     def generate_short_link(self):
-        """Генерирует уникальную короткую ссылку."""
-
-        length = 3
-        characters = string.ascii_letters + string.digits
-        while True:
-            short_link = ''.join(random.choices(characters, k=length))
-            if not ShortLink.objects.filter(short_link=short_link).exists():
-                break
-        return short_link
+        """
+        Детерминированный код по первичному ключу без проверок занятости.
+        Ключи делятся на диапазоны по длине кода (62^4 кодов длины 4,
+        затем 62^5 длины 5 и т. д.). Внутри диапазона номер перемешивается
+        раундами x -> (a * x + c) mod 62^L с разворотом цифр — каждый
+        шаг биективен, поэтому разные ключи дают разные коды.
+        """
+
+        base = len(SHORT_LINK_ALPHABET)
+        number, length = self.pk - 1, SHORT_LINK_MIN_LENGTH
+        while number >= base ** length:
+            number -= base ** length
+            length += 1
+        for _ in range(SHORT_LINK_ROUNDS):
+            number = (
+                number * SHORT_LINK_MULTIPLIER + SHORT_LINK_INCREMENT
+            ) % base ** length
+            reversed_number = 0
+            for _ in range(length):
+                number, digit = divmod(number, base)
+                reversed_number = reversed_number * base + digit
+            number = reversed_number
+        code = []
+        for _ in range(length):
+            number, digit = divmod(number, base)
+            code.append(SHORT_LINK_ALPHABET[digit])
+        return ''.join(code)
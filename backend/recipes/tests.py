@@ -0,0 +1,112 @@
+import os
+import tempfile
+from io import StringIO
+
+from api.cache import INGREDIENTS_SCOPE, RECIPES_SCOPE, get_generations
+from api.ingredient_index import ingredient_index
+from django.core.management import call_command
+from django.test import TestCase
+from users.models import User
+
+from .models import Ingredient, Recipe, RecipeIngredient, Tag
+
+
+def write_temporary(test, suffix, content):
+    """Временный файл, удаляемый после теста."""
+
+    descriptor, path = tempfile.mkstemp(suffix=suffix)
+    with os.fdopen(descriptor, 'w', encoding='utf-8') as file:
+        file.write(content)
+    test.addCleanup(os.remove, path)
+    return path
+
+
+class LoadIngredientsTest(TestCase):
+    """Повторная загрузка ничего не добавляет, новая — сбрасывает кэши."""
+
+    def load(self, path):
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('load_ingredients_csv', path, stdout=StringIO())
+
+    def test_reload_is_idempotent_and_bumps_caches(self):
+        path = write_temporary(
+            self, '.csv',
+            'name,measurement_unit\n'
+            'Соль,г\n Соль ,г\nСоль,щепотка\nПерец,г\n'
+        )
+        Ingredient.objects.create(name='Перец', measurement_unit='г')
+        self.assertEqual(
+            [row[1] for row in ingredient_index.search('соль')], []
+        )
+        before = get_generations(INGREDIENTS_SCOPE, RECIPES_SCOPE)
+        self.load(path)
+        loaded = get_generations(INGREDIENTS_SCOPE, RECIPES_SCOPE)
+        self.assertTrue(all(
+            new != old for new, old in zip(loaded, before)
+        ))
+        self.assertEqual(
+            sorted(ingredient_index.search('соль')),
+            sorted(Ingredient.objects.filter(name='Соль').values_list(
+                'id', 'name', 'measurement_unit'
+            ))
+        )
+        rows = set(Ingredient.objects.values_list('name', 'measurement_unit'))
+        self.assertEqual(rows, {
+            ('Соль', 'г'), ('Соль', 'щепотка'), ('Перец', 'г')
+        })
+        self.load(path)
+        self.assertEqual(Ingredient.objects.count(), len(rows))
+        self.assertEqual(
+            get_generations(INGREDIENTS_SCOPE, RECIPES_SCOPE), loaded
+        )
+
+
+class ExportImportTest(TestCase):
+    """Выгрузка, загруженная в пустую базу, выгружается так же."""
+
+    def setUp(self):
+        self.author = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Автор', last_name='Автор'
+        )
+        breakfast = Tag.objects.create(name='Завтрак', slug='breakfast')
+        dinner = Tag.objects.create(name='Ужин', slug='dinner')
+        salt = Ingredient.objects.create(name='Соль', measurement_unit='г')
+        flour = Ingredient.objects.create(name='Мука', measurement_unit='г')
+        for name, tags, amounts in (
+            ('Блины', (breakfast, dinner), {salt: 10, flour: 200}),
+            ('Каша', (breakfast,), {salt: 5}),
+        ):
+            recipe = Recipe.objects.create(
+                name=name, text=f'{name}: описание', cooking_time=15,
+                author=self.author, image=f'recipes/images/{name}.png'
+            )
+            recipe.tags.set(tags)
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                                 amount=amount)
+                for ingredient, amount in amounts.items()
+            )
+        User.objects.filter(pk=self.author.pk).update(recipes_count=2)
+
+    def export(self):
+        path = write_temporary(self, '.jsonl', '')
+        call_command('export_recipes', output=path, stderr=StringIO())
+        with open(path, encoding='utf-8') as file:
+            return path, file.read()
+
+    def test_round_trip(self):
+        path, exported = self.export()
+        self.assertEqual(len(exported.splitlines()), 2)
+        Recipe.objects.all().delete()
+        User.objects.filter(pk=self.author.pk).update(recipes_count=0)
+        call_command('import_recipes', path, stdout=StringIO())
+        self.assertEqual(self.export()[1], exported)
+        self.assertEqual(
+            User.objects.get(pk=self.author.pk).recipes_count, 2
+        )
+        self.assertEqual(Tag.objects.count(), 2)
+        self.assertEqual(Ingredient.objects.count(), 2)
+        # Повторная загрузка пропускает уже существующие рецепты.
+        call_command('import_recipes', path, stdout=StringIO())
+        self.assertEqual(Recipe.objects.count(), 2)
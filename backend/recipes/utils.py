@@ -0,0 +1,169 @@
+from collections import Counter
+
+from django.db import connection, transaction
+
+from .models import MediaFile, RecipeIngredient, ShoppingCart, ShoppingListItem
+
+
+def shift_shopping_lists(sign, recipe_ids=None, user_ids=None):
+    """
+    Прибавляет (sign=1) или вычитает (sign=-1) ингредиенты рецептов
+    из материализованных списков покупок всех, у кого они в корзине.
+    Одним запросом INSERT ... SELECT ... ON CONFLICT DO UPDATE,
+    после вычитания удаляет позиции с нулевым количеством.
+    Фильтры recipe_ids и user_ids сужают набор корзин.
+    """
+
+    quote = connection.ops.quote_name
+    table = quote(ShoppingListItem._meta.db_table)
+    conditions, params = ['TRUE'], [sign]
+    for column, values in (('recipe_id', recipe_ids),
+                           ('user_id', user_ids)):
+        if values is not None:
+            values = list(values)
+            if not values:
+                return
+            conditions.append(
+                f'cart.{column} IN ({", ".join(["%s"] * len(values))})'
+            )
+            params.extend(values)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} (user_id, ingredient_id, amount) '
+            'SELECT cart.user_id, item.ingredient_id, SUM(item.amount) * %s '
+            f'FROM {quote(RecipeIngredient._meta.db_table)} AS item '
+            f'JOIN {quote(ShoppingCart._meta.db_table)} AS cart '
+            'ON cart.recipe_id = item.recipe_id '
+            f'WHERE {" AND ".join(conditions)} '
+            'GROUP BY cart.user_id, item.ingredient_id '
+            'ON CONFLICT (user_id, ingredient_id) '
+            f'DO UPDATE SET amount = {table}.amount + EXCLUDED.amount',
+            params
+        )
+    if sign < 0:
+        stale = ShoppingListItem.objects.filter(amount__lte=0)
+        if user_ids is not None:
+            stale = stale.filter(user_id__in=user_ids)
+        elif recipe_ids is not None:
+            stale = stale.filter(user__shopping_cart__recipe_id__in=recipe_ids)
+        stale.delete()
+
+
+def shift_shopping_lists_by(recipe_id, deltas):
+    """
+    Применяет изменения количеств ингредиентов рецепта {ingredient_id:
+    delta} к спискам покупок всех, у кого рецепт в корзине. Возвращает
+    число затронутых строк списков.
+    """
+
+    if not deltas:
+        return 0
+    quote = connection.ops.quote_name
+    table = quote(ShoppingListItem._meta.db_table)
+    rows = ' UNION ALL '.join(
+        ['SELECT %s AS ingredient_id, %s AS amount'] * len(deltas)
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} (user_id, ingredient_id, amount) '
+            'SELECT cart.user_id, delta.ingredient_id, delta.amount '
+            f'FROM {quote(ShoppingCart._meta.db_table)} AS cart '
+            f'CROSS JOIN ({rows}) AS delta '
+            'WHERE cart.recipe_id = %s '
+            'ON CONFLICT (user_id, ingredient_id) '
+            f'DO UPDATE SET amount = {table}.amount + EXCLUDED.amount',
+            [value for row in deltas.items() for value in row] + [recipe_id]
+        )
+        touched = cursor.rowcount
+    deleted, _ = ShoppingListItem.objects.filter(
+        amount__lte=0,
+        ingredient_id__in=deltas,
+        user__shopping_cart__recipe_id=recipe_id
+    ).delete()
+    return touched + deleted
+
+
+def rebuild_shopping_lists(user_ids):
+    """Пересобирает списки покупок пользователей из их корзин."""
+
+    ShoppingListItem.objects.filter(user_id__in=user_ids).delete()
+    shift_shopping_lists(1, user_ids=user_ids)
+
+
+def shift_media_references(added=(), removed=()):
+    """
+    Прибавляет по ссылке на файлы added и снимает по одной с removed
+    одним INSERT ... ON CONFLICT DO UPDATE. Возвращает имена из removed,
+    на которые больше никто не ссылается.
+    """
+
+    deltas = Counter(name for name in added if name)
+    deltas.subtract(name for name in removed if name)
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if not deltas:
+        return []
+    quote = connection.ops.quote_name
+    table = quote(MediaFile._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} (name, reference_count) VALUES '
+            f'{", ".join(["(%s, %s)"] * len(deltas))} '
+            'ON CONFLICT (name) DO UPDATE SET reference_count = '
+            f'{table}.reference_count + EXCLUDED.reference_count',
+            [value for row in deltas.items() for value in row]
+        )
+    return list(MediaFile.objects.filter(
+        name__in=[name for name, delta in deltas.items() if delta < 0],
+        reference_count__lte=0
+    ).values_list('name', flat=True))
+
+
+def release_media(names, delete):
+    """
+    Удаляет файлы без ссылок. Счетчики перечитываются под блокировкой:
+    после коммита вычитания ту же картинку могли загрузить снова.
+    """
+
+    with transaction.atomic():
+        released = list(MediaFile.objects.select_for_update().filter(
+            name__in=names, reference_count__lte=0
+        ).values_list('name', flat=True))
+        MediaFile.objects.filter(name__in=released).delete()
+        for name in released:
+            delete(name)
+    return released
+
+
+def insert_user_recipes(model, user_id, recipe_ids):
+    """
+    Добавляет связи пользователя с рецептами (избранное, корзина)
+    одним INSERT ... ON CONFLICT DO NOTHING RETURNING: уже существующие
+    пропускаются без IntegrityError. Возвращает id реально добавленных.
+    """
+
+    recipe_ids = list(recipe_ids)
+    if not recipe_ids:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {connection.ops.quote_name(model._meta.db_table)} '
+            '(user_id, recipe_id) VALUES '
+            f'{", ".join(["(%s, %s)"] * len(recipe_ids))} '
+            'ON CONFLICT (user_id, recipe_id) DO NOTHING RETURNING recipe_id',
+            [value for recipe_id in recipe_ids
+             for value in (user_id, recipe_id)]
+        )
+        return [recipe_id for recipe_id, in cursor.fetchall()]
+
+
+def batched(rows, size):
+    """Разбивает поток строк на списки длиной не больше size."""
+
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -2,3 +2,4 @@ MAX_LENGTH_EMAIL = 254
 MAX_LENGTH_CHARFIELD = 150
 REGEX_USERNAME = r'^[\w.@+-]+$'
 FORBIDDEN_NAME = 'me'
+USER_COUNTER_FIELDS = ('recipes_count', 'followers_count')
@@ -0,0 +1,19 @@
+# Generated by Django 3.2 on 2026-10-17 06:19
+
+from django.db import migrations, models
+import foodgram_backend.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_counters'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='avatar',
+            field=models.ImageField(default=None, null=True, storage=foodgram_backend.storage.ContentAddressedStorage(), upload_to='users/', verbose_name='Аватар'),
+        ),
+    ]
@@ -1,6 +1,8 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
-from users.constants import MAX_LENGTH_CHARFIELD, MAX_LENGTH_EMAIL
+from foodgram_backend.storage import content_storage
+from users.constants import (MAX_LENGTH_CHARFIELD, MAX_LENGTH_EMAIL,
+                             USER_COUNTER_FIELDS)
 from users.validators import validate_username
 
 
@@ -44,9 +46,20 @@ class User(AbstractUser):
     avatar = models.ImageField(
         'Аватар',
         upload_to='users/',
+        storage=content_storage,
         null=True,
         default=None
     )
+    recipes_count = models.PositiveIntegerField(
+        'Количество рецептов',
+        default=0,
+        editable=False,
+    )
+    followers_count = models.PositiveIntegerField(
+        'Количество подписчиков',
+        default=0,
+        editable=False,
+    )
 
     class Meta:
         verbose_name = 'Пользователь'
@@ -62,6 +75,20 @@ class User(AbstractUser):
     def __str__(self):
         return self.username
 
+    def save(self, *args, **kwargs):
+        """
+        Счетчики меняются только атомарными F()-обновлениями,
+        поэтому обычное сохранение их не перезаписывает.
+        """
+
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in USER_COUNTER_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
 
 class Follower(models.Model):
     """Модель подписки на других пользователей."""